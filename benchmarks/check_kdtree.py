@@ -0,0 +1,101 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from features.machine_learning import ManhattanKNN
+
+# jitter of the probes drawn around the shipped training rows, in scaled units
+PROBE_JITTER = 0.02
+
+X_PATH = os.path.join(ROOT, 'features', 'x.npy')
+Y_PATH = os.path.join(ROOT, 'features', 'y.npy')
+
+def model(x_train, y_train, n_neighbors, index='brute'):
+
+    # the constructor always loads (and for 'kdtree' indexes) the files it is given, so it is handed
+    # the dataset under test directly instead of the shipped one that fit() would replace
+    directory = tempfile.mkdtemp()
+
+    try:
+        x_path, y_path = os.path.join(directory, 'x.npy'), os.path.join(directory, 'y.npy')
+        np.save(x_path, x_train)
+        np.save(y_path, y_train)
+
+        return ManhattanKNN(index=index, x_path=x_path, y_path=y_path, n_neighbors=n_neighbors)
+
+    finally:
+        shutil.rmtree(directory)
+
+def datasets(rows, probes, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    x = np.load(X_PATH).astype(np.float64)
+    y = np.load(Y_PATH)
+    near = x[rng.integers(0, x.shape[0], size=probes)] + rng.normal(0, PROBE_JITTER, size=(probes, x.shape[1]))
+
+    yield 'shipped', x, y, np.clip(near, 0, 1)
+
+    for n in rows:
+        yield f"uniform_{n}", rng.random((n, x.shape[1])), rng.integers(0, 4, size=n), rng.random((probes, x.shape[1]))
+
+def brute_neighbors(model, x_test):
+
+    # in the model's own memory-budgeted blocks, like predict
+    step = model.chunk_size()
+    return np.concatenate([model.nearest_neighbors(model.distance_block(x_test[start:start + step]))
+                           for start in range(0, x_test.shape[0], step)])
+
+def check(x_train, y_train, x_test, n_neighbors):
+
+    brute = model(x_train, y_train, n_neighbors)
+    tree = model(x_train, y_train, n_neighbors, index='kdtree')
+
+    started = time.perf_counter()
+    expected = brute.predict(x_test)
+    seconds_brute = time.perf_counter() - started
+
+    started = time.perf_counter()
+    labels = tree.predict(x_test)
+    seconds_tree = time.perf_counter() - started
+
+    # neighbor distances rather than indices, since brute force may order exact ties differently
+    neighbors = brute_neighbors(brute, x_test)
+    found = tree.tree.query(x_test, n_neighbors)
+
+    return {'labels_equal': bool(np.array_equal(expected, labels)),
+            'distances_equal': bool(np.array_equal(brute.neighbor_distances(x_test, neighbors),
+                                                   brute.neighbor_distances(x_test, found))),
+            'seconds_brute': seconds_brute,
+            'seconds_tree': seconds_tree}
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Check the KD-tree index against brute-force ManhattanKNN.")
+    parser.add_argument('--rows', default='20000,200000', help="comma separated synthetic training sizes")
+    parser.add_argument('--probes', type=int, default=5000)
+    parser.add_argument('--neighbors', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    rows = [int(float(i)) for i in args.rows.split(',') if i]
+    failed = False
+
+    for name, x_train, y_train, x_test in datasets(rows, args.probes):
+        result = check(x_train, y_train, x_test, args.neighbors)
+        failed |= not (result['labels_equal'] and result['distances_equal'])
+
+        print(f"{name:>16} labels {'ok' if result['labels_equal'] else 'DIFFER'}  "
+              f"distances {'ok' if result['distances_equal'] else 'DIFFER'}  "
+              f"brute {result['seconds_brute']:7.2f}s  kdtree {result['seconds_tree']:7.2f}s")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from features.machine_learning import ManhattanKNN
+from features.prototype_reduction import leave_one_out
+
+# (n_neighbors, weighting) pairs; the weighted ones need the neighbour distances in the vote
+CONFIGS = [(2, 'uniform'), (5, 'uniform'), (5, 'inverse'), (5, 'inverse_square')]
+
+def refit_leave_one_out(model, rows):
+
+    # the slow definition: a model fitted without the row, asked about it
+    x_train, y_train = np.asarray(model.x_train), np.asarray(model.y_train)
+    labels = np.empty(rows.shape[0], dtype=np.int8)
+
+    try:
+        for i, row in enumerate(rows):
+            keep = np.arange(x_train.shape[0]) != row
+            model.fit(x_train[keep], y_train[keep])
+            labels[i] = model.predict(np.asarray(x_train[row:row + 1], dtype=np.float64) / model.x_scale)[0]
+
+    finally:
+        model.fit(x_train, y_train)
+
+    return labels
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Check prototype_reduction.leave_one_out against refitting without each row.")
+    parser.add_argument('--rows', type=int, default=200, help="training rows checked per configuration")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    failed = False
+
+    for n_neighbors, weighting in CONFIGS:
+        model = ManhattanKNN(x_path=os.path.join(ROOT, 'features', 'x.npy'),
+                             y_path=os.path.join(ROOT, 'features', 'y.npy'),
+                             n_neighbors=n_neighbors, weighting=weighting)
+
+        rows = rng.choice(model.x_train.shape[0], min(args.rows, model.x_train.shape[0]), replace=False)
+        equal = bool(np.array_equal(leave_one_out(model)[rows], refit_leave_one_out(model, rows)))
+        failed |= not equal
+
+        print(f"k={n_neighbors} {weighting:>15} {'ok' if equal else 'DIFFER'}")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from features.machine_learning import MinMaxScaler
+
+# raw pollutant ranges the scaler was fitted on, used to draw plausible readings
+LOW = MinMaxScaler().min
+HIGH = MinMaxScaler().max
+
+def post(url, payload):
+
+    request = urllib.request.Request(url,
+                                     data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+def worker(url, batch, deadline, seed, latencies, errors):
+
+    rng = np.random.default_rng(seed)
+
+    while time.perf_counter() < deadline:
+        rows = rng.uniform(LOW, HIGH, size=(batch, len(LOW))).tolist()
+        payload = rows[0] if batch == 1 else {'rows': rows}
+
+        started = time.perf_counter()
+        try:
+            post(url, payload)
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            errors.append(1)
+
+def run(base_url, concurrency=16, duration=10.0, batch=1):
+
+    url = f"{base_url}/predict" if batch == 1 else f"{base_url}/predict/batch"
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    threads = [threading.Thread(target=worker, args=(url, batch, deadline, seed, latencies, errors))
+               for seed in range(concurrency)]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latency_ms = np.array(latencies) * 1000
+
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'rows_per_s': len(latencies) * batch / wall,
+            'requests_per_s': len(latencies) / wall,
+            'p50_ms': float(np.percentile(latency_ms, 50)) if latencies else None,
+            'p95_ms': float(np.percentile(latency_ms, 95)) if latencies else None,
+            'p99_ms': float(np.percentile(latency_ms, 99)) if latencies else None}
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Generate load against the local prediction service.")
+    parser.add_argument('--url', default='http://127.0.0.1:8502')
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    parser.add_argument('-b', '--batch', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    result = run(args.url, args.concurrency, args.duration, args.batch)
+    print(json.dumps(result, indent=2))
+
+    with urllib.request.urlopen(f"{args.url}/metrics", timeout=30) as response:
+        metrics = json.loads(response.read())
+    print(f"queue depth {metrics['queue_depth']}, batch sizes {metrics['batch_size']['counts']}")
+
+if __name__ == "__main__":
+    main()
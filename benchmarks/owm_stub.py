@@ -0,0 +1,61 @@
+import json
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# every request the stub answered, as (path, query) pairs
+CALLS = []
+
+# (lat, lon) query strings answered with an empty 'list', like a province the API has no data for
+EMPTY = set()
+
+def components(t):
+
+    # deterministic but varying readings, so daily aggregates and labels are not all the same
+    return {'co': 200.0 + t % 7, 'no': 0.1, 'no2': 3.0 + t % 5, 'o3': 40.0, 'so2': 2.0,
+            'pm2_5': 10.0 + t % 11, 'pm10': 20.0 - t % 3, 'nh3': 1.0}
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        CALLS.append((url.path, query))
+
+        if (query.get('lat'), query.get('lon')) in EMPTY:
+            readings = []
+
+        elif url.path.endswith('/history'):
+            # one reading per whole hour of [start, end], like the real endpoint
+            start = (int(query['start']) + 3599) // 3600 * 3600
+            readings = [{'dt': t, 'main': {'aqi': 1}, 'components': components(t)}
+                        for t in range(start, int(query['end']) + 1, 3600)]
+
+        else:
+            readings = [{'dt': 0, 'main': {'aqi': 1}, 'components': components(0)}]
+
+        body = json.dumps({'coord': {}, 'list': readings}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start(port=0):
+
+    # serves the OpenWeatherMap air pollution endpoints from a daemon thread; point OWM_BASE_URL
+    # at f"http://127.0.0.1:{server.server_port}/data/2.5" before features.openweathermap is imported
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+if __name__ == "__main__":
+    server = start(8503)
+    print(f"OpenWeatherMap stub on http://127.0.0.1:{server.server_port}/data/2.5")
+    threading.Event().wait()
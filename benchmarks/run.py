@@ -0,0 +1,259 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from features import arrow_engine
+from features.daily import process_hourly_to_daily
+from features.dashboard import by_city
+from features.export import parquet_available
+from features.ingest import list_cities, read_labeled_chunks, write_labeled_csv
+from features.machine_learning import MinMaxScaler, ManhattanKNN
+from features.prediction_cache import CachedPredictor
+
+# raw pollutant ranges the scaler was fitted on
+LOW = MinMaxScaler().min
+HIGH = MinMaxScaler().max
+
+COMPONENT_KEYS = ['co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3']
+
+# the KNN stages are quadratic-ish in wall time, so they stop earlier than the cheap stages
+DEFAULT_SIZES = {'transform': [10 ** i for i in range(2, 8)],
+                 'predict': [10 ** i for i in range(2, 6)],
+                 'predict_cached': [10 ** i for i in range(2, 6)],
+                 'hourly_to_daily': [10 ** i for i in range(2, 7)],
+                 'upload_pandas': [10 ** 4, 10 ** 5],
+                 'upload_arrow': [10 ** 4, 10 ** 5]}
+
+# Arrow allocates from its own pool, outside tracemalloc's view, so these report peak resident memory
+RSS_STAGES = {'upload_pandas', 'upload_arrow'}
+
+def synthetic_readings(n, seed=0, repeat=0.5):
+
+    rng = np.random.default_rng(seed)
+    unique = max(1, int(n * (1 - repeat)))
+
+    # a share of the rows repeat, like refreshed provinces or duplicated upload rows
+    readings = rng.uniform(LOW, HIGH, size=(unique, len(LOW)))
+    return readings[rng.integers(0, unique, size=n)]
+
+def synthetic_history(n, seed=0, start=1609459200):
+
+    rng = np.random.default_rng(seed)
+    values = rng.gamma(2.0, 20.0, size=(n, len(COMPONENT_KEYS)))
+    aqi = rng.integers(1, 6, size=n)
+
+    return [{'dt': start + 3600 * i,
+             'main': {'aqi': int(aqi[i])},
+             'components': dict(zip(COMPONENT_KEYS, values[i].tolist()))}
+            for i in range(n)]
+
+def synthetic_upload(n, path, seed=0, cities=500, days=5 * 365):
+
+    # an upload-shaped CSV: repeated city names and dates, and the six pollutant columns
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    names = np.array([f"Kota {i}" for i in range(cities)])
+    dates = pd.date_range('2019-01-01', periods=days).strftime('%Y-%m-%d').to_numpy()
+    readings = synthetic_readings(n, seed)
+
+    frame = pd.DataFrame(readings, columns=['pm10', 'pm2.5', 'so2', 'co', 'o3', 'no2'])
+    frame.insert(0, 'tanggal', dates[rng.integers(0, days, size=n)])
+    frame.insert(0, 'nama_kota', names[rng.integers(0, cities, size=n)])
+    frame.to_csv(path, index=False)
+
+    return path
+
+def resident_bytes():
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def measure_rss(function):
+
+    # the work runs once in a forked child; its peak resident set minus what it started with
+    import multiprocessing
+    import resource
+
+    def child(queue):
+        baseline = resident_bytes()
+        function()
+        queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - baseline)
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=child, args=(queue,))
+    process.start()
+    peak = queue.get()
+    process.join()
+
+    return peak
+
+def measure(function, repeat, rss=False):
+
+    timings = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+
+    if rss:
+        return min(timings), measure_rss(function)
+
+    # tracing slows allocation-heavy code down, so memory gets its own untimed run
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(timings), peak
+
+def stages(model, scaler):
+
+    def transform(n):
+        x = synthetic_readings(n)
+        return lambda: scaler.transform(x)
+
+    def predict(n):
+        x = scaler.transform(synthetic_readings(n))
+        return lambda: model.predict(x)
+
+    def predict_cached(n):
+        x = scaler.transform(synthetic_readings(n))
+        # a fresh cache per run, so the number reflects deduplication rather than warm hits
+        return lambda: CachedPredictor(model).predict(x)
+
+    def hourly_to_daily(n):
+        history = synthetic_history(n)
+        return lambda: process_hourly_to_daily(history)
+
+    def upload(write_labeled, read_cities, read_stats, suffix, modules=()):
+
+        # the page_2 path end to end: score the file, then the city list and every city's dashboard
+        def setup(n):
+            # imported before the fork, so the measured resident set is data rather than library code
+            for module in modules:
+                importlib.import_module(module)
+
+            # one scratch directory, overwritten per size, so multi-million-row runs do not pile up
+            directory = os.path.join(tempfile.gettempdir(), 'air_quality_benchmark')
+            os.makedirs(directory, exist_ok=True)
+
+            source = synthetic_upload(n, os.path.join(directory, 'upload.csv'))
+            scored = os.path.join(directory, f"scored.{suffix}")
+
+            def run():
+                with open(source, 'rb') as file, open(scored, 'wb') as output:
+                    write_labeled(file, scaler, model, output=output)
+                read_cities(scored)
+                read_stats(scored)
+
+            return run
+
+        return setup
+
+    upload_pandas = upload(write_labeled_csv, list_cities, lambda path: by_city(read_labeled_chunks(path)), 'csv')
+    upload_arrow = upload(arrow_engine.write_labeled_parquet, arrow_engine.list_cities, arrow_engine.by_city, 'parquet',
+                          ('pyarrow.csv', 'pyarrow.compute', 'pyarrow.parquet'))
+
+    return {'transform': transform,
+            'predict': predict,
+            'predict_cached': predict_cached,
+            'hourly_to_daily': hourly_to_daily,
+            'upload_pandas': upload_pandas,
+            **({'upload_arrow': upload_arrow} if parquet_available() else {})}
+
+def run(selected=None, max_rows=None, repeat=3, sizes=None):
+
+    model = ManhattanKNN(x_path=os.path.join(ROOT, 'features', 'x.npy'),
+                         y_path=os.path.join(ROOT, 'features', 'y.npy'))
+    scaler = MinMaxScaler()
+    results = []
+
+    for stage, setup in stages(model, scaler).items():
+        if selected and stage not in selected:
+            continue
+
+        for n in sizes or DEFAULT_SIZES[stage]:
+            if max_rows and n > max_rows:
+                continue
+
+            seconds, peak = measure(setup(n), repeat, rss=stage in RSS_STAGES)
+            results.append({'stage': stage,
+                            'rows': n,
+                            'seconds': seconds,
+                            'rows_per_s': n / seconds if seconds > 0 else None,
+                            'peak_bytes': peak})
+
+            print(f"{stage:>16} {n:>10} rows  {seconds * 1000:10.2f} ms  "
+                  f"{n / seconds:14.0f} rows/s  {peak / 1024 ** 2:8.1f} MiB", flush=True)
+
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results}
+
+def compare(current, baseline, threshold):
+
+    previous = {(i['stage'], i['rows']): i for i in baseline['results']}
+    regressions = []
+
+    for result in current['results']:
+        old = previous.get((result['stage'], result['rows']))
+        if old is None:
+            continue
+
+        for metric in ('seconds', 'peak_bytes'):
+            if old[metric] and result[metric] > old[metric] * (1 + threshold):
+                regressions.append({'stage': result['stage'],
+                                    'rows': result['rows'],
+                                    'metric': metric,
+                                    'baseline': old[metric],
+                                    'current': result[metric],
+                                    'ratio': result[metric] / old[metric]})
+
+    return regressions
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the scaling, prediction and aggregation hot paths offline.")
+    parser.add_argument('--stage', action='append', choices=sorted(DEFAULT_SIZES))
+    parser.add_argument('--sizes', default=None, help="comma separated row counts, e.g. 100,1e7; overrides the per-stage defaults")
+    parser.add_argument('--max-rows', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmarks/results.json')
+    parser.add_argument('--baseline', default=None, help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown/growth, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(i)) for i in args.sizes.split(',')] if args.sizes else None
+    current = run(args.stage, args.max_rows, args.repeat, sizes)
+
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(current, json.load(f), args.threshold)
+
+    for i in regressions:
+        print(f"REGRESSION {i['stage']} {i['rows']} rows {i['metric']}: "
+              f"{i['baseline']:.4g} -> {i['current']:.4g} ({i['ratio']:.2f}x)")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,214 @@
+import os
+import tempfile
+import numpy as np
+from features.export import parquet_available, write_parquet_tables
+from features.ingest import COLUMNS, POLLUTANTS, CHUNK_ROWS, SPOOL_MAX_SIZE, SchemaError, detect_format, read_excel_chunks
+from features.instrumentation import timed
+from features.labels import CATEGORY, CODE_DTYPE
+
+# 'arrow' reads, scores and writes uploads as Arrow tables when pyarrow is installed; anything else keeps pandas
+ENGINE = os.getenv("AIR_QUALITY_ENGINE", "pandas")
+
+# stored dictionary-encoded: one copy of each distinct city/date plus an int32 index per row
+STRING_COLUMNS = ['nama_kota', 'tanggal', 'provinsi']
+
+# bytes of CSV text per record batch (about 8k rows); the reader keeps several blocks in flight,
+# so larger blocks mostly buy resident memory rather than speed
+BLOCK_SIZE = 1024 ** 2
+
+def enabled():
+    return ENGINE == 'arrow' and parquet_available()
+
+def active_engine():
+
+    # the engine actually in use, for cache keys; 'arrow' without pyarrow runs on pandas
+    return 'arrow' if enabled() else 'pandas'
+
+def encode_strings(table):
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    for name in STRING_COLUMNS:
+        i = table.schema.get_field_index(name)
+
+        if i >= 0 and pa.types.is_string(table.schema.field(i).type):
+            table = table.set_column(i, name, pc.dictionary_encode(table.column(i)))
+
+    return table
+
+def from_frame(df):
+
+    import pyarrow as pa
+
+    return encode_strings(pa.Table.from_pandas(df, preserve_index=False))
+
+def read_tables(file, chunksize=CHUNK_ROWS):
+
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    # chunksize only applies to Excel; CSV is cut into BLOCK_SIZE batches by the Arrow reader
+    if detect_format(file) == 'xlsx':
+        for df in read_excel_chunks(file, chunksize):
+            yield from_frame(df)
+        return
+
+    types = {**{name: pa.float64() for name in POLLUTANTS},
+             **{name: pa.string() for name in STRING_COLUMNS}}
+
+    try:
+        reader = pacsv.open_csv(file,
+                                read_options=pacsv.ReadOptions(block_size=BLOCK_SIZE),
+                                convert_options=pacsv.ConvertOptions(column_types=types))
+
+    # a file without even a header line, like pandas' EmptyDataError in ingest.read_chunks
+    except pa.ArrowInvalid:
+        raise SchemaError("Kolom masih belum sesuai! ")
+
+    for batch in reader:
+        yield encode_strings(pa.Table.from_batches([batch]))
+
+def column_buffer(column):
+
+    import pyarrow as pa
+
+    # a float64 column in one chunk without nulls is viewed in place; anything else is copied once
+    if column.type != pa.float64():
+        column = column.cast(pa.float64())
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+    if column.null_count:
+        return column.to_numpy(zero_copy_only=False)
+
+    return column.to_numpy(zero_copy_only=True)
+
+def label_array(codes):
+
+    import pyarrow as pa
+
+    # the model's int8 codes are the indices; the names are stored once, like LABEL_DTYPE
+    return pa.DictionaryArray.from_arrays(pa.array(np.asarray(codes, dtype=CODE_DTYPE)),
+                                          pa.array(list(CATEGORY.values())),
+                                          ordered=True)
+
+def label_tables(tables, scaler, model):
+
+    for table in tables:
+        if set(COLUMNS) - set(table.column_names):
+            raise SchemaError("Kolom masih belum sesuai! ")
+
+        x = scaler.transform_columns([column_buffer(table.column(name)) for name in POLLUTANTS])
+        yield table.append_column('label', label_array(model.predict(x)))
+
+def unique_strings(column):
+
+    import pyarrow.compute as pc
+
+    # first-seen order, like Series.unique; a blank cell becomes 'nan', the name by_city files it under
+    return ['nan' if i is None else i for i in pc.unique(column).to_pylist()]
+
+@timed('ingest.score_upload')
+def write_labeled_parquet(file, scaler, model, chunksize=CHUNK_ROWS, output=None):
+
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+
+    rows = 0
+    cities = {}
+
+    def tally(tables):
+
+        nonlocal rows
+
+        for table in tables:
+            rows += table.num_rows
+            cities.update(dict.fromkeys(unique_strings(table.column('nama_kota'))))
+
+            yield table
+
+    write_parquet_tables(tally(label_tables(read_tables(file, chunksize), scaler, model)), output)
+
+    if rows == 0:
+        raise SchemaError("File belum berisi data! ")
+
+    output.seek(0)
+    return output, rows, list(cities)
+
+def read_labeled_tables(source, columns=None):
+
+    import pyarrow.parquet as pq
+
+    # one row group at a time, so memory follows the write batch size rather than the file size
+    parquet = pq.ParquetFile(source)
+
+    for i in range(parquet.num_row_groups):
+        yield parquet.read_row_group(i, columns=columns)
+
+def read_labeled_frames(source, columns=None):
+
+    for table in read_labeled_tables(source, columns):
+        yield table.to_pandas()
+
+def list_cities(source):
+
+    cities = {}
+    for table in read_labeled_tables(source, ['nama_kota']):
+        cities.update(dict.fromkeys(unique_strings(table.column('nama_kota'))))
+
+    return list(cities)
+
+def dictionary_values(column):
+
+    import pyarrow as pa
+
+    # Parquet written by pandas or other tools holds plain strings; they are encoded here instead
+    if not pa.types.is_dictionary(column.type):
+        column = column.dictionary_encode()
+
+    # the dictionary once per batch and the row indices as a NumPy view; null rows point one past the end
+    dictionary = column.dictionary.to_pylist()
+    indices = column.indices.fill_null(len(dictionary)) if column.null_count else column.indices
+
+    return dictionary + [None], indices.to_numpy(zero_copy_only=False)
+
+def by_city(source):
+
+    from features.dashboard import update_groups
+
+    # the same accumulators as dashboard.by_city, grouped on the city dictionary instead of row strings
+    codes_of = {name: code for code, name in CATEGORY.items()}
+    stats = {}
+
+    for table in read_labeled_tables(source, POLLUTANTS + ['label', 'nama_kota']):
+        for batch in table.to_batches():
+            x = np.empty((batch.num_rows, len(POLLUTANTS)), order='F')
+            for j, name in enumerate(POLLUTANTS):
+                x[:, j] = column_buffer(batch.column(name))
+
+            labels, label_index = dictionary_values(batch.column('label'))
+            codes = np.array([codes_of.get(i, 0) for i in labels], dtype=CODE_DTYPE)[label_index]
+
+            cities, city_index = dictionary_values(batch.column('nama_kota'))
+            update_groups(stats, [str(i) if i is not None else 'nan' for i in cities], city_index, x, codes)
+
+    return stats
+
+def write_csv(tables, f):
+
+    import pyarrow.csv as pacsv
+
+    writer = None
+
+    try:
+        for table in tables:
+            if writer is None:
+                writer = pacsv.CSVWriter(f, table.schema, write_options=pacsv.WriteOptions(quoting_style='needed'))
+
+            writer.write_table(table)
+
+    finally:
+        if writer is not None:
+            writer.close()
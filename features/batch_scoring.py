@@ -0,0 +1,186 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from features.ingest import CHUNK_ROWS, POLLUTANTS, read_chunks, validate
+from features.labels import to_categorical
+from features.model_registry import get_predictor, get_scaler
+
+SUFFIXES = ('.csv', '.xlsx', '.parquet')
+
+def expand_inputs(patterns):
+
+    paths = []
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+
+        paths += [path for path in matches
+                  if os.path.isfile(path) and path.lower().endswith(SUFFIXES)]
+
+    # keep the first occurrence when patterns overlap
+    return list(dict.fromkeys(paths))
+
+def read_parquet_chunks(path, chunksize):
+
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+        yield batch.to_pandas()
+
+def read_input(path, chunksize):
+
+    if path.lower().endswith('.parquet'):
+        yield from read_parquet_chunks(path, chunksize)
+        return
+
+    with open(path, 'rb') as f:
+        yield from read_chunks(f, chunksize)
+
+def input_root(paths):
+
+    # the deepest directory holding every input; outputs mirror the layout below it
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else ''
+
+def output_path(path, output_dir, fmt, root=None):
+
+    # the source extension stays in the name, so data.csv and data.xlsx do not share an output
+    name = os.path.relpath(os.path.abspath(path), root) if root else os.path.basename(path)
+    return os.path.join(output_dir, f"{name}.labeled.{fmt}")
+
+def score_file(path, output_dir, fmt='csv', chunksize=CHUNK_ROWS, root=None):
+
+    from features.export import write_parquet_streaming
+
+    scaler = get_scaler()
+    model = get_predictor()
+    stats = {'path': path, 'output': output_path(path, output_dir, fmt, root),
+             'rows': 0, 'read_s': 0.0, 'predict_s': 0.0, 'write_s': 0.0}
+
+    def labeled():
+
+        chunks = read_input(path, chunksize)
+
+        while True:
+            started = time.perf_counter()
+            df = next(chunks, None)
+            stats['read_s'] += time.perf_counter() - started
+
+            if df is None:
+                return
+
+            validate(df)
+
+            started = time.perf_counter()
+            data = scaler.transform(df[POLLUTANTS].to_numpy(dtype=float))
+            df['label'] = to_categorical(model.predict(data))
+            stats['predict_s'] += time.perf_counter() - started
+
+            stats['rows'] += df.shape[0]
+            yield df
+
+    started = time.perf_counter()
+
+    os.makedirs(os.path.dirname(stats['output']) or '.', exist_ok=True)
+
+    try:
+        with open(stats['output'], 'wb') as f:
+            if fmt == 'parquet':
+                write_parquet_streaming(labeled(), f)
+            else:
+                for i, df in enumerate(labeled()):
+                    df.to_csv(f, index=False, header=(i == 0))
+
+    except Exception:
+        # never leave a half-labeled file next to the good ones
+        if os.path.exists(stats['output']):
+            os.remove(stats['output'])
+        raise
+
+    # whatever the generator did not account for was spent serializing
+    total = time.perf_counter() - started
+    stats['write_s'] = total - stats['read_s'] - stats['predict_s']
+    stats['wall_s'] = total
+
+    return stats
+
+def score_files(inputs, output_dir, fmt='csv', workers=None, chunksize=CHUNK_ROWS):
+
+    paths = expand_inputs(inputs)
+    root = input_root(paths)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # inputs that would still land on one output (e.g. on a case-insensitive file system) are
+    # refused up front rather than left to overwrite each other in parallel
+    owners = {}
+    for path in paths:
+        owners.setdefault(os.path.normcase(output_path(path, output_dir, fmt, root)), []).append(path)
+
+    clashes = {path: others for others in owners.values() if len(others) > 1 for path in others}
+
+    started = time.perf_counter()
+
+    # files are independent, so each one is scored in its own process
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(score_file, path, output_dir, fmt, chunksize, root)
+                   for path in paths if path not in clashes}
+        files = []
+
+        for path in paths:
+            if path in clashes:
+                files.append({'path': path, 'error': f"OutputCollision: same output as {', '.join(i for i in clashes[path] if i != path)}"})
+                continue
+
+            try:
+                files.append(futures[path].result())
+            except Exception as e:
+                files.append({'path': path, 'error': f"{type(e).__name__}: {e}"})
+
+    wall = time.perf_counter() - started
+    scored = [i for i in files if 'error' not in i]
+    rows = sum(i['rows'] for i in scored)
+
+    summary = {'files': files,
+               'rows': rows,
+               'failed': len(files) - len(scored),
+               'wall_s': wall,
+               'rows_per_s': rows / wall if wall > 0 else 0.0,
+               'stages_s': {stage: sum(i[stage] for i in scored)
+                            for stage in ('read_s', 'predict_s', 'write_s')}}
+
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return summary
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Label air quality readings without the Streamlit UI.")
+    parser.add_argument('inputs', nargs='+', help="CSV, Excel or Parquet files, directories or glob patterns")
+    parser.add_argument('-o', '--output-dir', default='output')
+    parser.add_argument('-f', '--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    summary = score_files(args.inputs, args.output_dir, args.format, args.workers, args.chunksize)
+
+    for i in summary['files']:
+        if 'error' in i:
+            print(f"{i['path']}: {i['error']}")
+        else:
+            print(f"{i['path']} -> {i['output']}: {i['rows']} rows in {i['wall_s']:.2f}s")
+
+    print(f"{summary['rows']} rows in {summary['wall_s']:.2f}s "
+          f"({summary['rows_per_s']:.0f} rows/s), "
+          + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in summary['stages_s'].items()))
+
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,204 @@
+import argparse
+import os
+import threading
+import time
+from features import history_cache
+from features.daily import COMPONENTS
+from features.instrumentation import stage
+from features.openweathermap import get_current_reading, fetch_many
+from features.provinces import load_provinces
+
+# next to the history cache, in the same AIR_QUALITY_CACHE_DIR
+DB_NAME = "current_readings.sqlite"
+
+# seconds between polls; 0 keeps the Streamlit process from starting its own collector
+INTERVAL = int(os.getenv("AIR_QUALITY_COLLECTOR_INTERVAL", 15 * 60))
+
+# two missed polls in a row usually means the collector or the API is down; the pages refresh
+# readings older than this themselves
+STALE_AFTER = 2 * (INTERVAL or 15 * 60)
+
+# rows older than this are pruned after every cycle
+RETENTION = 90 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    province TEXT NOT NULL,
+    collected_at INTEGER NOT NULL,
+    observed_at INTEGER,
+    pm10 REAL NOT NULL,
+    pm2_5 REAL NOT NULL,
+    so2 REAL NOT NULL,
+    co REAL NOT NULL,
+    o3 REAL NOT NULL,
+    no2 REAL NOT NULL,
+    label INTEGER NOT NULL,
+    PRIMARY KEY (province, collected_at)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS readings_collected_at ON readings (collected_at);
+"""
+
+# the pollutant columns keep OpenWeatherMap's component keys, in model feature order
+COLUMNS = ['province', 'collected_at', 'observed_at'] + list(COMPONENTS) + ['label']
+
+_lock = threading.Lock()
+_collector = None
+
+def db_path():
+    return history_cache.db_path(DB_NAME)
+
+def connect(path=None):
+    return history_cache.connect(path or db_path(), SCHEMA)
+
+def append(connection, rows):
+
+    with connection:
+        connection.executemany(f"INSERT OR REPLACE INTO readings ({', '.join(COLUMNS)}) "
+                               f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+
+def prune(connection, now, retention=RETENTION):
+
+    with connection:
+        connection.execute("DELETE FROM readings WHERE collected_at < ?", (now - retention,))
+
+def last_collected(connection):
+    return connection.execute("SELECT MAX(collected_at) FROM readings").fetchone()[0]
+
+def latest(province, path=None):
+
+    # one index seek on (province, collected_at); None until the first cycle has stored the province
+    connection = connect(path)
+
+    try:
+        row = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM readings WHERE province = ? "
+                                 "ORDER BY collected_at DESC LIMIT 1", (province,)).fetchone()
+    finally:
+        connection.close()
+
+    return None if row is None else dict(zip(COLUMNS, row))
+
+def latest_all(path=None):
+
+    connection = connect(path)
+
+    try:
+        rows = connection.execute(f"SELECT {', '.join('r.' + i for i in COLUMNS)} FROM readings r "
+                                  "JOIN (SELECT province, MAX(collected_at) AS collected_at "
+                                  "      FROM readings GROUP BY province) m "
+                                  "USING (province, collected_at) ORDER BY r.province").fetchall()
+    finally:
+        connection.close()
+
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+def collect_once(api_key, fetch=get_current_reading, now=None, path=None, interval=None):
+
+    # interval, when given, skips the cycle if another process already collected within it
+    import numpy as np
+    from features.model_registry import get_predictor, get_scaler
+
+    now = int(time.time()) if now is None else now
+    connection = connect(path)
+
+    try:
+        if interval:
+            previous = last_collected(connection)
+            if previous is not None and now - previous < interval * 0.9:
+                return 0
+
+        provinces = load_provinces()
+
+        with stage('collector.fetch', rows=len(provinces)):
+            readings = fetch_many(fetch, [(i.latitude, i.longitude, api_key) for i in provinces])
+
+        fetched = [(province, reading) for province, reading in zip(provinces, readings)
+                   if reading is not None]
+
+        if not fetched:
+            return 0
+
+        values = np.abs(np.array([[reading['components'][key] for key in COMPONENTS]
+                                  for _, reading in fetched], dtype=np.float64))
+
+        # one batched prediction for every province of the cycle
+        labels = get_predictor().predict(get_scaler().transform(values))
+
+        append(connection, [(province.name, now, reading.get('dt'), *map(float, value), int(label))
+                            for (province, reading), value, label in zip(fetched, values, labels)])
+        prune(connection, now)
+
+        return len(fetched)
+
+    finally:
+        connection.close()
+
+class Collector(threading.Thread):
+
+    def __init__(self, api_key, interval=INTERVAL, fetch=get_current_reading, path=None):
+
+        super().__init__(name='air-quality-collector', daemon=True)
+
+        self.api_key = api_key
+        self.interval = interval
+        self.fetch = fetch
+        self.path = path
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+
+        while not self.stopped.is_set():
+            try:
+                collect_once(self.api_key, self.fetch, path=self.path, interval=self.interval)
+                self.error = None
+
+            except Exception as e:
+                # a failed cycle is retried on the next tick rather than ending the thread
+                self.error = e
+                print(f"Error collecting air pollution data: {e}")
+
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+def start_collector(api_key, interval=INTERVAL):
+
+    # one collector per process, shared by every session and rerun
+    global _collector
+
+    with _lock:
+        if interval and api_key and (_collector is None or not _collector.is_alive()):
+            _collector = Collector(api_key, interval)
+            _collector.start()
+
+        return _collector
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Poll current air pollution for every province and store the predictions.")
+    parser.add_argument('--interval', type=int, default=INTERVAL or 15 * 60, help="seconds between polls")
+    parser.add_argument('--once', action='store_true', help="collect a single cycle and exit")
+    parser.add_argument('--db', default=None, help=f"SQLite file, default {db_path()}")
+    args = parser.parse_args(argv)
+
+    api_key = os.getenv("API_KEY")
+
+    if args.once:
+        print(f"{collect_once(api_key, path=args.db)} provinces stored")
+        return 0
+
+    collector = Collector(api_key, args.interval, path=args.db)
+    collector.start()
+
+    try:
+        while collector.is_alive():
+            collector.join(1)
+    except KeyboardInterrupt:
+        collector.stop()
+
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
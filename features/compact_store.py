@@ -0,0 +1,94 @@
+import sys
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# full scale of the fixed-point representation of the [0, 1] scaled features
+QUANT_SCALE = {'uint16': float(np.iinfo(np.uint16).max),
+               'float32': 1.0,
+               'float64': 1.0}
+
+def save_compact(path, x_train, y_train, scaler, dtype='uint16'):
+
+    if dtype not in QUANT_SCALE:
+        raise ValueError(f"Unsupported compact dtype: {dtype}")
+
+    x_train = np.asarray(x_train, dtype=np.float64)
+    scale = QUANT_SCALE[dtype]
+
+    if dtype == 'uint16':
+        x_compact = np.rint(np.clip(x_train, 0, 1) * scale).astype(np.uint16)
+    else:
+        x_compact = x_train.astype(dtype)
+
+    with open(path, 'wb') as f:
+        np.savez(f,
+                 version=np.array(FORMAT_VERSION),
+                 dtype=np.array(dtype),
+                 scale=np.array(scale),
+                 min=np.asarray(scaler.min, dtype=np.float64),
+                 max=np.asarray(scaler.max, dtype=np.float64),
+                 x=x_compact,
+                 y=np.asarray(y_train).astype(np.uint8))
+
+def load_compact(path, scaler=None):
+
+    # scaler, when given, must be the one the features were scaled with; the stored points mean
+    # nothing next to inputs scaled over different ranges
+    with np.load(path) as store:
+        version = int(store['version'])
+
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact model version: {version}")
+
+        header = {'version': version,
+                  'dtype': str(store['dtype']),
+                  'scale': float(store['scale']),
+                  'min': store['min'],
+                  'max': store['max']}
+
+        if scaler is not None and not (np.array_equal(header['min'], np.asarray(scaler.min, dtype=np.float64)) and
+                                       np.array_equal(header['max'], np.asarray(scaler.max, dtype=np.float64))):
+            raise ValueError(f"Compact model {path} was scaled with min={header['min'].tolist()} "
+                             f"max={header['max'].tolist()}, which does not match the scaler in use")
+
+        return store['x'], store['y'], header
+
+def convert(x_path, y_path, out_path, dtype='uint16'):
+
+    from features.machine_learning import MinMaxScaler
+
+    save_compact(out_path, np.load(x_path), np.load(y_path), MinMaxScaler(), dtype)
+
+def check_equivalence(out_path, x_path='features/x.npy', y_path='features/y.npy',
+                      n_samples=20000, seed=0):
+
+    from features.machine_learning import ManhattanKNN
+
+    reference = ManhattanKNN(x_path=x_path, y_path=y_path)
+    compact = ManhattanKNN(compact_path=out_path)
+
+    # probe both the training points themselves and random points around them
+    rng = np.random.default_rng(seed)
+    x_test = np.vstack([reference.x_train,
+                        rng.uniform(-0.1, 1.1, size=(n_samples, reference.x_train.shape[1]))])
+
+    agreement = np.mean(np.asarray(reference.predict(x_test)) ==
+                        np.asarray(compact.predict(x_test)))
+
+    working_set = reference.x_train.nbytes + reference.y_train.nbytes
+    compact_set = compact.x_train.nbytes + compact.y_train.nbytes
+
+    return {'agreement': float(agreement),
+            'rows': int(x_test.shape[0]),
+            'bytes_full': int(working_set),
+            'bytes_compact': int(compact_set),
+            'ratio': working_set / compact_set}
+
+if __name__ == "__main__":
+
+    out_path = sys.argv[1] if len(sys.argv) > 1 else 'features/model_compact.npz'
+    dtype = sys.argv[2] if len(sys.argv) > 2 else 'uint16'
+
+    convert('features/x.npy', 'features/y.npy', out_path, dtype)
+    print(check_equivalence(out_path))
@@ -0,0 +1,101 @@
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from features.instrumentation import timed
+
+# OpenWeatherMap component key -> column name used across the pages
+COMPONENTS = {'pm10': 'pm10',
+              'pm2_5': 'pm2.5',
+              'so2': 'so2',
+              'co': 'co',
+              'o3': 'o3',
+              'no2': 'no2'}
+
+AGGREGATIONS = ('mean', 'max', 'p95', 'aqi')
+
+SECONDS_PER_DAY = 86400
+
+def decode(hourly_data):
+
+    n = len(hourly_data)
+    getter = itemgetter(*COMPONENTS)
+
+    time = np.fromiter((i['dt'] for i in hourly_data), dtype=np.int64, count=n)
+    values = np.array([getter(i['components']) for i in hourly_data], dtype=np.float64).reshape(n, len(COMPONENTS))
+
+    return time, values
+
+def decode_aqi(hourly_data):
+    return np.array([i.get('main', {}).get('aqi', np.nan) for i in hourly_data], dtype=np.float64)
+
+def percentile(values, day, starts, counts, q):
+
+    # sorting by (day, value) puts every day's readings in ascending order; NaNs go last
+    result = np.empty((starts.shape[0], values.shape[1]))
+
+    for j in range(values.shape[1]):
+        order = np.lexsort((values[:, j], day))
+        column = values[order, j]
+        valid = counts[:, j]
+
+        # linear interpolation, as np.percentile does by default
+        position = (valid - 1) * q / 100
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(valid - 1, 0))
+        fraction = position - lower
+
+        low = column[np.clip(starts + lower, 0, column.shape[0] - 1)]
+        high = column[np.clip(starts + upper, 0, column.shape[0] - 1)]
+
+        result[:, j] = np.where(valid > 0, low + (high - low) * fraction, np.nan)
+
+    return result
+
+@timed('daily.aggregate', rows=lambda hourly_data, *args, **kwargs: len(hourly_data or ()))
+def process_hourly_to_daily(hourly_data, aggregations=('mean',)):
+
+    if not hourly_data:
+        return None
+
+    unknown = set(aggregations) - set(AGGREGATIONS)
+    if unknown:
+        raise ValueError(f"Unknown aggregations: {sorted(unknown)}")
+
+    time, values = decode(hourly_data)
+
+    # UTC days since the epoch; the same buckets as pd.to_datetime(..., utc=True).dt.date
+    day = time // SECONDS_PER_DAY
+    order = np.argsort(day, kind='stable')
+    day = day[order]
+    values = values[order]
+
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    missing = np.isnan(values)
+
+    counts = np.add.reduceat(~missing, starts, axis=0)
+    columns = list(COMPONENTS.values())
+    result = {}
+
+    if 'mean' in aggregations:
+        sums = np.add.reduceat(np.where(missing, 0, values), starts, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+
+        result.update(zip(columns, means.T))
+
+    if 'max' in aggregations:
+        maxima = np.fmax.reduceat(values, starts, axis=0)
+        result.update(zip([f"{i}_max" for i in columns], maxima.T))
+
+    if 'p95' in aggregations:
+        p95 = percentile(values, day, starts, counts, 95)
+        result.update(zip([f"{i}_p95" for i in columns], p95.T))
+
+    if 'aqi' in aggregations:
+        # worst hourly OpenWeatherMap index (1-5) seen during the day
+        aqi = decode_aqi(hourly_data)[order]
+        result['aqi'] = np.fmax.reduceat(aqi, starts)
+
+    index = pd.Index(day[starts].astype('datetime64[D]').astype(object), name='time')
+    return pd.DataFrame(result, index=index)
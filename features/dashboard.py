@@ -0,0 +1,168 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from features.ingest import POLLUTANTS
+from features.labels import CATEGORY, chart_names, encode, names
+
+N_CLASSES = len(CATEGORY)
+
+MAX_CACHED = 256
+
+# the city argument of get_stats that stands for the whole dataset; no city name can equal it
+ALL_CITIES = object()
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+def accumulate(x, codes, groups, n_groups, n_classes=N_CLASSES):
+
+    # per (group, class): row count, then per pollutant the non-missing count, sum and sum of squares,
+    # each from one bincount over the combined group/class key
+    x = np.asarray(x, dtype=np.float64).reshape(np.size(codes), -1)
+    key = np.asarray(groups, dtype=np.int64).reshape(-1) * n_classes + np.asarray(codes, dtype=np.int64).reshape(-1)
+    size = n_groups * n_classes
+
+    missing = np.isnan(x)
+    filled = np.where(missing, 0.0, x)
+
+    counts = np.bincount(key, minlength=size).reshape(n_groups, n_classes)
+    valid = np.empty((n_groups, n_classes, x.shape[1]), dtype=np.int64)
+    sums = np.empty((n_groups, n_classes, x.shape[1]))
+    squares = np.empty((n_groups, n_classes, x.shape[1]))
+
+    for j in range(x.shape[1]):
+        valid[:, :, j] = np.bincount(key, weights=~missing[:, j], minlength=size).reshape(n_groups, n_classes)
+        sums[:, :, j] = np.bincount(key, weights=filled[:, j], minlength=size).reshape(n_groups, n_classes)
+        squares[:, :, j] = np.bincount(key, weights=filled[:, j] ** 2, minlength=size).reshape(n_groups, n_classes)
+
+    return counts, valid, sums, squares
+
+class DashboardStats:
+
+    def __init__(self, n_features=len(POLLUTANTS), n_classes=N_CLASSES):
+
+        # per class and pollutant: non-missing count, sum, and sum of squares
+        self.counts = np.zeros(n_classes, dtype=np.int64)
+        self.valid = np.zeros((n_classes, n_features), dtype=np.int64)
+        self.sums = np.zeros((n_classes, n_features))
+        self.squares = np.zeros((n_classes, n_features))
+
+    def update(self, x, codes):
+
+        counts, valid, sums, squares = accumulate(x, codes, np.zeros(np.size(codes), dtype=np.int64), 1,
+                                                  self.counts.shape[0])
+
+        self.counts += counts[0]
+        self.valid += valid[0]
+        self.sums += sums[0]
+        self.squares += squares[0]
+
+        return self
+
+    def merge(self, other):
+
+        self.counts += other.counts
+        self.valid += other.valid
+        self.sums += other.sums
+        self.squares += other.squares
+
+        return self
+
+    def label_counts(self):
+
+        present = np.flatnonzero(self.counts)
+        return pd.DataFrame({'label': names(present),
+                             'count': self.counts[present]})
+
+    def means(self):
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.valid
+
+    def mean_table(self):
+
+        # long format, one row per (pollutant, label), with the '0:BAIK' names the chart sorts by
+        present = np.flatnonzero(self.counts)
+        means = self.means()
+
+        return pd.DataFrame({'params': np.repeat(POLLUTANTS, present.shape[0]),
+                             'values': means[present].T.reshape(-1),
+                             'labels': chart_names(present) * len(POLLUTANTS)})
+
+    def correlations(self):
+
+        # Pearson r between each pollutant and the label code, over rows where the pollutant is present
+        code = np.arange(self.counts.shape[0], dtype=np.float64)[:, None]
+
+        n = self.valid.sum(axis=0)
+        sum_x = self.sums.sum(axis=0)
+        sum_xx = self.squares.sum(axis=0)
+        sum_y = (self.valid * code).sum(axis=0)
+        sum_yy = (self.valid * code ** 2).sum(axis=0)
+        sum_xy = (self.sums * code).sum(axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariance = n * sum_xy - sum_x * sum_y
+            spread = np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2))
+            r = np.where(spread > 0, covariance / spread, np.nan)
+
+        return pd.DataFrame({'index': POLLUTANTS, 'label': r})
+
+def from_frame(df):
+    return DashboardStats().update(df[POLLUTANTS].to_numpy(dtype=float), encode(df['label']))
+
+def update_groups(stats, names, groups, x, codes):
+
+    # feeds every group's accumulator from one pass; names[i] is the city of group index i
+    counts, valid, sums, squares = accumulate(x, codes, groups, len(names))
+
+    for i in np.flatnonzero(counts.sum(axis=1)):
+        entry = stats.setdefault(names[i], DashboardStats())
+
+        entry.counts += counts[i]
+        entry.valid += valid[i]
+        entry.sums += sums[i]
+        entry.squares += squares[i]
+
+    return stats
+
+def by_city(chunks, city_column='nama_kota'):
+
+    # one pass over the chunks feeds every city's accumulator at once
+    stats = {}
+
+    for df in chunks:
+        cities, city_index = np.unique(df[city_column].to_numpy(dtype=object).astype(str),
+                                       return_inverse=True)
+
+        update_groups(stats, cities.tolist(), city_index, df[POLLUTANTS].to_numpy(dtype=float), encode(df['label']))
+
+    return stats
+
+def get_stats(dataset_key, city, build):
+
+    # build() returns {city: DashboardStats} for the whole dataset; every city, and the whole
+    # dataset under ALL_CITIES, is cached from that one pass. Cities are looked up by their str(),
+    # so a blank city read back as NaN finds the 'nan' group by_city filed it under
+    city = city if city is ALL_CITIES else str(city)
+
+    with _lock:
+        if (dataset_key, city) in _cache:
+            _cache.move_to_end((dataset_key, city))
+            return _cache[(dataset_key, city)]
+
+    stats = build()
+
+    total = DashboardStats()
+    for entry in stats.values():
+        total.merge(entry)
+
+    with _lock:
+        for name, entry in {**stats, ALL_CITIES: total}.items():
+            _cache[(dataset_key, name)] = entry
+
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+
+        return total if city is ALL_CITIES else stats.get(city)
@@ -0,0 +1,48 @@
+from contextlib import contextmanager, nullcontext
+import streamlit as st
+from features import instrumentation
+
+@contextmanager
+def debug_session():
+
+    # ?debug=1 records this run's stages; ?profile=cprofile|pyinstrument also profiles it
+    debug = st.query_params.get("debug") == "1"
+    profile_kind = st.query_params.get("profile")
+
+    if not debug and not profile_kind:
+        yield
+        return
+
+    profiler = instrumentation.profile(profile_kind) if profile_kind else nullcontext(None)
+
+    with instrumentation.session() as records, profiler as profile:
+        yield
+
+    render(records, profile)
+
+def render(records, profile=None):
+
+    with st.expander("Debug: waktu per tahap", expanded=True):
+
+        if records:
+            import pandas as pd
+
+            st.dataframe(pd.DataFrame(records), hide_index=True)
+        else:
+            st.write("Tidak ada tahap yang tercatat.")
+
+        st.download_button(label="Download JSON",
+                           data=instrumentation.to_json(records),
+                           file_name="stages.json",
+                           mime="application/json")
+
+        st.download_button(label="Download Prometheus",
+                           data=instrumentation.to_prometheus(records),
+                           file_name="stages.prom",
+                           mime="text/plain")
+
+        if profile is not None and profile['note']:
+            st.caption(profile['note'])
+
+        if profile is not None and profile['report']:
+            st.text(profile['report'])
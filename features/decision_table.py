@@ -0,0 +1,405 @@
+import argparse
+import hashlib
+import json
+import time
+import numpy as np
+from features.instrumentation import timed
+
+FORMAT_VERSION = 2
+
+# node codes; anything below INTERNAL is a leaf whose whole cell has that label
+INTERNAL = 254
+FALLBACK = 255
+
+DEFAULT_DEPTH = 6
+
+# cell coordinates are packed into one int64 key per cell while building
+MAX_DEPTH = 10
+
+# jittered copies of every training row that mark where the tree is worth refining
+SUPPORT_COPIES = 4
+SUPPORT_JITTER = 0.02
+
+# float slack kept between the bounds, so rounding in the distance kernel cannot flip a certified cell
+MARGIN = 1e-9
+
+# the registry only puts a table in front of the model when its build-time probes ran at least this
+# much faster than exact KNN; the shipped data measures ~1.5x (about a third of the probes hit)
+MIN_SPEEDUP = 2.0
+
+# a predictor whose traffic stays below this hit rate after WARMUP_ROWS stops consulting the table;
+# a lookup costs about 1% of an exact prediction, so fewer hits than this barely pay for themselves
+MIN_HIT_RATE = 0.05
+WARMUP_ROWS = 10_000
+
+def training_hash(model):
+
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(model.x_train).tobytes())
+    digest.update(np.ascontiguousarray(model.y_train).tobytes())
+    digest.update(repr((model.n, model.weighting, model.x_scale)).encode())
+
+    return digest.hexdigest()
+
+class DecisionTable:
+
+    def __init__(self, kind, depth, n_features, train_hash, hit_rate=None, speedup=None):
+
+        # one uint8 per node of a binary tree in breadth-first order; level t halves axis
+        # t % n_features, so the leaves line up with a 2 ** depth grid per axis
+        self.kind = np.asarray(kind, dtype=np.uint8)
+        self.depth = depth
+        self.n_features = n_features
+        self.train_hash = train_hash
+
+        # measured on jittered probes when the table was built; None for tables nobody measured
+        self.hit_rate = hit_rate
+        self.speedup = speedup
+
+        internal = self.kind == INTERNAL
+        self.first_child = np.where(internal, 1 + (np.cumsum(internal) - 1) * 2, 0)
+
+    def lookup(self, x_test):
+
+        # labels for the rows whose cell is certified, FALLBACK for the rest
+        x_test = np.asarray(x_test, dtype=np.float64).reshape(-1, self.n_features)
+        cells = 2 ** self.depth
+
+        inside = np.all((x_test >= 0) & (x_test <= 1), axis=1)
+        coords = np.clip(np.floor(x_test * cells), 0, cells - 1).astype(np.int64)
+
+        node = np.zeros(x_test.shape[0], dtype=np.int64)
+
+        for level in range(self.depth * self.n_features):
+            internal = np.flatnonzero(self.kind[node] == INTERNAL)
+            if internal.shape[0] == 0:
+                break
+
+            axis, split = level % self.n_features, level // self.n_features
+            child = (coords[internal, axis] >> (self.depth - 1 - split)) & 1
+            node[internal] = self.first_child[node[internal]] + child
+
+        labels = self.kind[node]
+        labels[~inside | (labels == INTERNAL)] = FALLBACK
+
+        return labels
+
+    def save(self, path):
+
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     version=np.array(FORMAT_VERSION),
+                     depth=np.array(self.depth),
+                     n_features=np.array(self.n_features),
+                     train_hash=np.array(self.train_hash),
+                     hit_rate=np.array(np.nan if self.hit_rate is None else self.hit_rate),
+                     speedup=np.array(np.nan if self.speedup is None else self.speedup),
+                     kind=self.kind)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as store:
+            version = int(store['version'])
+
+            if version not in (1, FORMAT_VERSION):
+                raise ValueError(f"Unsupported decision table version: {version}")
+
+            # version 1 tables were saved before their hit rate was recorded
+            measured = [float(store[name]) if name in store.files else np.nan for name in ('hit_rate', 'speedup')]
+            hit_rate, speedup = [None if np.isnan(i) else i for i in measured]
+
+            return cls(store['kind'], int(store['depth']), int(store['n_features']), str(store['train_hash']),
+                       hit_rate, speedup)
+
+def box_bounds(centre, half, x_train):
+
+    # smallest and largest L1 distance from any point of each box to each training row;
+    # per axis they are |t - centre| shifted by the half width, clipped at zero for the lower one
+    lower = np.zeros((centre.shape[0], x_train.shape[0]))
+    upper = np.zeros_like(lower)
+    buffer = np.empty_like(lower)
+
+    for j in range(x_train.shape[1]):
+        np.subtract(centre[:, j, None], x_train[:, j], out=buffer)
+        np.abs(buffer, out=buffer)
+        upper += buffer
+
+        buffer -= half[j]
+        np.maximum(buffer, 0, out=buffer)
+        lower += buffer
+
+    upper += half.sum()
+
+    return lower, upper
+
+def certify_block(centre, half, x_train, y_train, bounds, n):
+
+    # bounds[c]:bounds[c + 1] is the slice of training rows with class c
+    lower, upper = box_bounds(centre, half, x_train)
+    n_classes = len(bounds) - 1
+
+    labels = np.full(centre.shape[0], FALLBACK, dtype=np.uint8)
+    rows = np.arange(centre.shape[0])
+
+    if n <= 2:
+        # with k <= 2 the vote always goes to the nearest row's class, so one class only has to be
+        # provably nearer than every other class from everywhere in the box
+        best_upper = np.full((centre.shape[0], n_classes), np.inf)
+        best_lower = np.full((centre.shape[0], n_classes), np.inf)
+
+        for c in range(n_classes):
+            if bounds[c + 1] > bounds[c]:
+                best_upper[:, c] = upper[:, bounds[c]:bounds[c + 1]].min(axis=1)
+                best_lower[:, c] = lower[:, bounds[c]:bounds[c + 1]].min(axis=1)
+
+        winner = np.argmin(best_upper, axis=1)
+        best_lower[rows, winner] = np.inf
+
+        certified = best_upper[rows, winner] + MARGIN < best_lower.min(axis=1)
+        labels[certified] = winner[certified]
+
+        return labels
+
+    # otherwise the same k rows have to be the nearest everywhere, with a clear majority among them
+    candidates = np.argpartition(upper, n - 1, axis=1)[:, :n]
+    worst = upper[rows[:, None], candidates].max(axis=1)
+
+    lower[rows[:, None], candidates] = np.inf
+    stable = worst + MARGIN < lower.min(axis=1)
+
+    counts = np.zeros((centre.shape[0], n_classes), dtype=np.int64)
+    np.add.at(counts, (np.repeat(rows, n), y_train[candidates].reshape(-1)), 1)
+
+    top = np.sort(counts, axis=1)
+    certified = stable & (top[:, -1] > top[:, -2])
+    labels[certified] = np.argmax(counts, axis=1)[certified]
+
+    return labels
+
+def certify(model, cells, width, block=256):
+
+    x_train = np.asarray(model.x_train, dtype=np.float64) / model.x_scale
+    y_train = np.asarray(model.y_train).astype(np.int64)
+
+    order = np.argsort(y_train, kind='stable')
+    x_train, y_train = x_train[order], y_train[order]
+    bounds = np.searchsorted(y_train, np.arange(int(y_train.max()) + 2))
+
+    half = width / 2
+    labels = np.empty(cells.shape[0], dtype=np.uint8)
+
+    for start in range(0, cells.shape[0], block):
+        centre = cells[start:start + block] * width + half
+        labels[start:start + block] = certify_block(centre, half, x_train, y_train, bounds, model.n)
+
+    return labels
+
+def cell_keys(coords, depth):
+    return (coords << (depth * np.arange(coords.shape[1]))).sum(axis=1)
+
+def support_points(x, copies=SUPPORT_COPIES, jitter=SUPPORT_JITTER, seed=0):
+
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float64)
+
+    points = [x] + [x + rng.normal(0, jitter, size=x.shape) for _ in range(copies)]
+    points = np.vstack(points)
+
+    return points[np.all((points >= 0) & (points <= 1), axis=1)]
+
+def build_table(model, depth=DEFAULT_DEPTH, support=None):
+
+    # split level by level; every new cell is certified, and only uncertified cells that hold
+    # support points are split again, so the tree stays sparse away from the data
+    n_features = model.x_train.shape[1]
+
+    if not 0 <= depth <= MAX_DEPTH or depth * n_features > 63:
+        raise ValueError(f"Unsupported decision table depth: {depth}")
+
+    # the k > 2 certificate counts votes; distance weights can move the majority inside a cell
+    if model.n > 2 and model.weighting != 'uniform':
+        raise ValueError("Decision tables need uniform voting when more than two neighbors vote")
+
+    if support is None:
+        support = support_points(np.asarray(model.x_train, dtype=np.float64) / model.x_scale)
+
+    cells = np.zeros((1, n_features), dtype=np.int64)
+    splits = np.zeros(n_features, dtype=np.int64)
+    levels = []
+
+    for level in range(depth * n_features + 1):
+        width = 2.0 ** -splits
+
+        kind = certify(model, cells, width)
+        uncertified = kind == FALLBACK
+
+        if level < depth * n_features and uncertified.any():
+            occupied = np.unique(cell_keys(np.clip(np.floor(support / width), 0, 2 ** splits - 1)
+                                           .astype(np.int64), depth))
+            split = uncertified & np.isin(cell_keys(cells, depth), occupied)
+        else:
+            split = np.zeros_like(uncertified)
+
+        kind[split] = INTERNAL
+        levels.append(kind)
+
+        if not split.any():
+            break
+
+        # children are the lower and upper half of the parent along this level's axis
+        axis = level % n_features
+        cells = np.repeat(cells[split], 2, axis=0)
+        cells[:, axis] = cells[:, axis] * 2 + np.tile([0, 1], cells.shape[0] // 2)
+        splits[axis] += 1
+
+    return DecisionTable(np.concatenate(levels), depth, n_features, training_hash(model))
+
+def load_table(path, model):
+
+    table = DecisionTable.load(path)
+
+    if table.train_hash != training_hash(model):
+        raise ValueError(f"Decision table {path} was built for a different training set")
+
+    return table
+
+def pays_off(table, min_speedup=MIN_SPEEDUP):
+    return table.speedup is not None and table.speedup >= min_speedup
+
+class CompiledPredictor:
+
+    def __init__(self, model, table, fallback=None):
+
+        # fallback answers the rows the table cannot (e.g. a CachedPredictor); the model by default
+        self.model = model
+        self.table = table
+        self.fallback = model if fallback is None else fallback
+        self.invalidate()
+
+    def invalidate(self):
+
+        # a table is tied to one training set; the registry builds a new predictor when it changes
+        self.hits = 0
+        self.fallbacks = 0
+        self.bypassed = False
+
+        if hasattr(self.fallback, 'invalidate'):
+            self.fallback.invalidate()
+
+    def stats(self):
+
+        total = self.hits + self.fallbacks
+        return {'hits': self.hits,
+                'fallbacks': self.fallbacks,
+                'hit_rate': self.hits / total if total else None,
+                'bypassed': self.bypassed,
+                'measured_hit_rate': self.table.hit_rate,
+                'nodes': int(self.table.kind.shape[0])}
+
+    @timed('compiled.predict', rows=lambda self, x_test: int(np.size(x_test) // self.table.n_features))
+    def predict(self, x_test):
+
+        x_test = np.asarray(x_test, dtype=np.float64).reshape(-1, self.table.n_features)
+
+        # traffic that keeps missing the table (readings unlike the training set) skips the lookup
+        if self.bypassed:
+            self.fallbacks += x_test.shape[0]
+            return self.fallback.predict(x_test)
+
+        kind = self.table.lookup(x_test)
+
+        # cells near a decision boundary, or outside the table, go to the exact model
+        missing = np.flatnonzero(kind == FALLBACK)
+        labels = kind.astype(np.int8)
+
+        if missing.shape[0]:
+            labels[missing] = self.fallback.predict(x_test[missing])
+
+        self.hits += x_test.shape[0] - missing.shape[0]
+        self.fallbacks += missing.shape[0]
+
+        total = self.hits + self.fallbacks
+        if total >= WARMUP_ROWS and self.hits < MIN_HIT_RATE * total:
+            self.bypassed = True
+
+        return labels
+
+def evaluate(model, table, x_reference, n_samples=20000, jitter=SUPPORT_JITTER, seed=1):
+
+    # probes around real readings, and uniform ones over the whole scaled box for contrast
+    rng = np.random.default_rng(seed)
+
+    probes = {'jittered': x_reference[rng.integers(0, x_reference.shape[0], n_samples)]
+                          + rng.normal(0, jitter, size=(n_samples, x_reference.shape[1])),
+              'uniform': rng.uniform(0, 1, size=(n_samples, x_reference.shape[1]))}
+    report = {}
+
+    for name, x_test in probes.items():
+        compiled = CompiledPredictor(model, table)
+
+        started = time.perf_counter()
+        table.lookup(x_test)
+        lookup_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        labels = compiled.predict(x_test)
+        compiled_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        exact = model.predict(x_test)
+        exact_seconds = time.perf_counter() - started
+
+        report[name] = {'rows': n_samples,
+                        'agreement': float(np.mean(labels == exact)),
+                        'hit_rate': compiled.stats()['hit_rate'],
+                        'seconds_exact': exact_seconds,
+                        'seconds_lookup': lookup_seconds,
+                        'seconds_compiled': compiled_seconds,
+                        'speedup': exact_seconds / compiled_seconds}
+
+    return report
+
+def main(argv=None):
+
+    from features.machine_learning import ManhattanKNN
+
+    parser = argparse.ArgumentParser(description="Compile ManhattanKNN decisions into a lookup tree over the scaled space.")
+    parser.add_argument('output', nargs='?', default='features/decision_table.npz')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help="grid resolution is 2 ** depth cells per axis")
+    parser.add_argument('--compact-path', default=None, help="build for a compact or prototype model instead of x.npy/y.npy")
+    parser.add_argument('--x-path', default='features/x.npy', help="readings the table is refined around")
+    parser.add_argument('--support-copies', type=int, default=SUPPORT_COPIES)
+    parser.add_argument('--support-jitter', type=float, default=SUPPORT_JITTER)
+    parser.add_argument('--samples', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    model = ManhattanKNN(compact_path=args.compact_path)
+    x_reference = np.load(args.x_path)
+
+    started = time.perf_counter()
+    support = support_points(x_reference, args.support_copies, args.support_jitter)
+    table = build_table(model, args.depth, support)
+    build_seconds = time.perf_counter() - started
+
+    # the jittered figures travel with the table, so the registry can tell whether it is worth using
+    evaluation = evaluate(model, table, x_reference, args.samples, args.support_jitter)
+    table.hit_rate = evaluation['jittered']['hit_rate']
+    table.speedup = evaluation['jittered']['speedup']
+    table.save(args.output)
+
+    kind = table.kind
+    report = {'depth': args.depth,
+              'build_seconds': build_seconds,
+              'nodes': int(kind.shape[0]),
+              'certified_leaves': int(np.sum(kind < INTERNAL)),
+              'fallback_leaves': int(np.sum(kind == FALLBACK)),
+              'bytes': int(kind.nbytes),
+              'evaluation': evaluation,
+              'used_by_registry': pays_off(table)}
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+import pandas as pd
+from features.instrumentation import stage
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'prediksi_kualitas_udara_exports')
+
+# oldest exports are dropped once the cache directory grows past this
+MAX_CACHE_BYTES = 1024 ** 3
+
+# frames with more rows than this go through the streaming write-only Excel writer
+LARGE_FRAME_ROWS = 50_000
+
+EXTENSION = {'csv': 'csv',
+             'xlsx': 'xlsx',
+             'parquet': 'parquet'}
+
+MIME = {'csv': 'text/csv',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'parquet': 'application/vnd.apache.parquet'}
+
+HASH_BLOCK = 1024 ** 2
+
+_lock = threading.Lock()
+
+def content_hash(*parts):
+
+    digest = hashlib.sha256()
+
+    for part in parts:
+        if hasattr(part, 'read'):
+            position = part.tell()
+            part.seek(0)
+
+            for block in iter(lambda: part.read(HASH_BLOCK), b''):
+                digest.update(block)
+
+            part.seek(position)
+
+        elif isinstance(part, bytes):
+            digest.update(part)
+
+        else:
+            digest.update(repr(part).encode())
+
+    return digest.hexdigest()
+
+def frame_hash(df, *parts):
+
+    rows = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return content_hash(rows.tobytes(), tuple(df.columns), *parts)
+
+def export_path(key, fmt):
+    return os.path.join(CACHE_DIR, f"{key}.{EXTENSION[fmt]}")
+
+def is_ready(key, fmt):
+    return os.path.exists(export_path(key, fmt))
+
+def write_atomic(path, write):
+
+    # written under a unique name and renamed, so readers never see a half-written file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial = f"{path}.{uuid.uuid4().hex}.partial"
+
+    try:
+        with open(partial, 'wb') as f:
+            write(f)
+        os.replace(partial, path)
+
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def get_export(key, fmt, build):
+
+    path = export_path(key, fmt)
+
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    with stage(f'export.build.{fmt}'):
+        write_atomic(path, build)
+
+    evict()
+    return path
+
+def read_export(path):
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+def evict():
+
+    with _lock:
+        entries = []
+
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith('.partial'):
+                continue
+
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= MAX_CACHE_BYTES:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def parquet_available():
+
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+
+    return True
+
+def write_csv(df, f):
+    df.to_csv(f, index=False)
+
+def write_excel_streaming(chunks, f):
+
+    from openpyxl import Workbook
+
+    # write-only workbooks stream rows to the archive instead of holding every cell object
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+
+    for i, df in enumerate(chunks):
+        if i == 0:
+            sheet.append([str(column) for column in df.columns])
+
+        df = df.astype(object).where(df.notna(), None)
+        for row in df.itertuples(index=False, name=None):
+            sheet.append(row)
+
+    workbook.save(f)
+
+def write_excel(df, f):
+
+    if df.shape[0] > LARGE_FRAME_ROWS:
+        write_excel_streaming([df], f)
+    else:
+        df.to_excel(f, index=False, sheet_name="Sheet1")
+
+def write_parquet_tables(tables, f):
+
+    import pyarrow.parquet as pq
+
+    writer = None
+
+    try:
+        for table in tables:
+            # later chunks follow the first one's schema (e.g. a column that was all nulls)
+            if writer is None:
+                writer = pq.ParquetWriter(f, table.schema)
+            else:
+                table = table.cast(writer.schema)
+
+            writer.write_table(table)
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+def write_parquet_streaming(chunks, f):
+
+    import pyarrow as pa
+
+    write_parquet_tables((pa.Table.from_pandas(df, preserve_index=False) for df in chunks), f)
+
+def write_parquet(df, f):
+    write_parquet_streaming([df], f)
@@ -0,0 +1,206 @@
+import contextvars
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from features.instrumentation import timed
+from features.openweathermap import get_hourly_air_pollution, split_range, WINDOW, WINDOW_WORKERS
+
+CACHE_DIR = os.getenv("AIR_QUALITY_CACHE_DIR", ".cache")
+DB_NAME = "air_pollution_history.sqlite"
+
+# a range that was still open when fetched is re-checked after this many seconds
+TTL = 3 * 3600
+
+# hours older than this at fetch time are treated as final and never refetched
+SETTLE = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hourly (
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    dt INTEGER NOT NULL,
+    aqi INTEGER,
+    components TEXT NOT NULL,
+    PRIMARY KEY (lat, lon, dt)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS coverage (
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    fetched_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS coverage_location ON coverage (lat, lon);
+"""
+
+def db_path(name=DB_NAME):
+    return os.path.join(CACHE_DIR, name)
+
+def connect(path=None, schema=SCHEMA):
+
+    # shared with the collector's readings store, which passes its own file and schema
+    path = path or db_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # WAL lets the pages read the latest rows while another thread or process is writing
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(schema)
+
+    return connection
+
+def location_key(latitude, longitude):
+    return round(float(latitude), 6), round(float(longitude), 6)
+
+def merge(intervals):
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return merged
+
+def missing_ranges(covered, start, end):
+
+    gaps = []
+    cursor = start
+
+    for covered_start, covered_end in merge(covered):
+        if covered_end < cursor:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start - 1))
+
+        cursor = covered_end + 1
+
+    if cursor <= end:
+        gaps.append((cursor, end))
+
+    return gaps
+
+def covered_ranges(connection, lat, lon, now):
+
+    rows = connection.execute("SELECT start, end, fetched_at FROM coverage WHERE lat = ? AND lon = ?",
+                              (lat, lon)).fetchall()
+    covered = []
+
+    for start, end, fetched_at in rows:
+        if now - fetched_at < TTL:
+            # a fresh range that reached the present at fetch time still counts as up to date
+            covered.append((start, now if end >= fetched_at else end))
+        else:
+            # only the part that had settled when it was fetched stays valid forever
+            final_end = min(end, fetched_at - SETTLE)
+            if final_end >= start:
+                covered.append((start, final_end))
+
+    return covered
+
+def compact(connection, lat, lon, now):
+
+    # past the TTL a row only vouches for what had settled when it was fetched, and settled
+    # ranges never change, so those are merged; rows still inside the TTL are kept as they are
+    rows = connection.execute("SELECT start, end, fetched_at FROM coverage WHERE lat = ? AND lon = ?",
+                              (lat, lon)).fetchall()
+
+    fresh = [row for row in rows if now - row[2] < TTL]
+    settled = [(start, min(end, fetched_at - SETTLE), fetched_at) for start, end, fetched_at in rows
+               if now - fetched_at >= TTL and min(end, fetched_at - SETTLE) >= start]
+
+    kept = []
+    for start, end in merge([(start, end) for start, end, _ in settled]):
+        # the latest fetch of the merged pieces still puts the whole range before its SETTLE cutoff
+        fetched_at = max(f for s, e, f in settled if s >= start and e <= end)
+        kept.append((start, end, fetched_at))
+
+    if len(kept) + len(fresh) == len(rows):
+        return
+
+    connection.execute("DELETE FROM coverage WHERE lat = ? AND lon = ?", (lat, lon))
+    connection.executemany("INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                           [(lat, lon, start, end, fetched_at) for start, end, fetched_at in kept + fresh])
+
+def store(connection, lat, lon, start, end, hourly_data, now):
+
+    connection.executemany("INSERT OR REPLACE INTO hourly VALUES (?, ?, ?, ?, ?)",
+                           [(lat, lon, int(i['dt']), i.get('main', {}).get('aqi'),
+                             json.dumps(i['components']))
+                            for i in hourly_data])
+    connection.execute("INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                       (lat, lon, start, end, now))
+
+def load(connection, lat, lon, start, end):
+
+    rows = connection.execute("SELECT dt, aqi, components FROM hourly "
+                              "WHERE lat = ? AND lon = ? AND dt BETWEEN ? AND ? ORDER BY dt",
+                              (lat, lon, start, end))
+
+    return [{'dt': dt, 'main': {'aqi': aqi}, 'components': json.loads(components)}
+            for dt, aqi, components in rows]
+
+def fetch_windows(connection, latitude, longitude, lat, lon, gaps, api_key, fetch, now, window):
+
+    windows = [piece for gap_start, gap_end in gaps
+               for piece in split_range(gap_start, gap_end, window)]
+    error = None
+
+    with ThreadPoolExecutor(max_workers=WINDOW_WORKERS) as executor:
+        # copies of the caller's context keep the fetch stages in its instrumentation session
+        futures = {executor.submit(contextvars.copy_context().run, fetch, latitude, longitude, start, end, api_key): (start, end)
+                   for start, end in windows}
+
+        # every window is stored as soon as it arrives, so a failure only costs that window
+        for future in as_completed(futures):
+            start, end = futures[future]
+
+            try:
+                hourly_data = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+
+            with connection:
+                store(connection, lat, lon, start, end, hourly_data, now)
+
+    if error is not None:
+        raise error
+
+@timed('history.get')
+def get_hourly_history(latitude, longitude, start_ts, end_ts, api_key,
+                       fetch=get_hourly_air_pollution, now=None, path=None, window=WINDOW):
+
+    now = int(time.time()) if now is None else int(now)
+    lat, lon = location_key(latitude, longitude)
+
+    # nothing exists after now, so an open-ended range is only fetched up to the present
+    end = min(int(end_ts), now)
+    connection = connect(path)
+
+    try:
+        if end >= start_ts:
+            covered = covered_ranges(connection, lat, lon, now)
+
+            # only the hours that are not already final (or still fresh) go to the API
+            gaps = missing_ranges(covered, int(start_ts), end)
+
+            try:
+                fetch_windows(connection, latitude, longitude, lat, lon, gaps, api_key, fetch, now, window)
+
+            finally:
+                # one row per fetched window would otherwise pile up for as long as the server runs
+                with connection:
+                    compact(connection, lat, lon, now)
+
+        return load(connection, lat, lon, int(start_ts), int(end_ts))
+
+    finally:
+        connection.close()
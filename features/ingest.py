@@ -0,0 +1,127 @@
+import tempfile
+import pandas as pd
+from features.instrumentation import timed
+from features.labels import LABEL_DTYPE, to_categorical
+
+COLUMNS = ['nama_kota', 'tanggal', 'pm10', 'pm2.5',
+           'so2', 'co', 'o3', 'no2']
+
+POLLUTANTS = ['pm10', 'pm2.5',
+              'so2', 'co', 'o3', 'no2']
+
+# xlsx files are zip archives; everything else is treated as delimited text
+XLSX_SIGNATURE = b'PK\x03\x04'
+
+CHUNK_ROWS = 50_000
+
+# spooled outputs stay in memory up to this size, then move to a temp file on disk
+SPOOL_MAX_SIZE = 32 * 1024 ** 2
+
+class SchemaError(ValueError):
+    pass
+
+def detect_format(file):
+
+    position = file.tell()
+    signature = file.read(len(XLSX_SIGNATURE))
+    file.seek(position)
+
+    return 'xlsx' if signature == XLSX_SIGNATURE else 'csv'
+
+def read_excel_chunks(file, chunksize):
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+
+        if header is None:
+            return
+
+        header = [str(name) if name is not None else '' for name in header]
+        block = []
+        empty = True
+
+        for row in rows:
+            block.append(row)
+            empty = False
+
+            if len(block) == chunksize:
+                yield pd.DataFrame(block, columns=header)
+                block = []
+
+        # a header-only sheet still yields its columns, so they get validated like a CSV header
+        if block or empty:
+            yield pd.DataFrame(block, columns=header)
+
+    finally:
+        workbook.close()
+
+def read_chunks(file, chunksize=CHUNK_ROWS):
+
+    if detect_format(file) == 'xlsx':
+        return read_excel_chunks(file, chunksize)
+
+    try:
+        return pd.read_csv(file, chunksize=chunksize)
+
+    except pd.errors.EmptyDataError:
+        raise SchemaError("Kolom masih belum sesuai! ")
+
+def validate(df):
+
+    if set(COLUMNS) & set(df.columns) != set(COLUMNS):
+        raise SchemaError("Kolom masih belum sesuai! ")
+
+def label_chunks(chunks, scaler, model):
+
+    for df in chunks:
+        validate(df)
+
+        data = scaler.transform(df[POLLUTANTS].to_numpy(dtype=float))
+        df['label'] = to_categorical(model.predict(data))
+
+        yield df
+
+@timed('ingest.score_upload')
+def write_labeled_csv(file, scaler, model, chunksize=CHUNK_ROWS, output=None):
+
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+
+    rows = 0
+    cities = {}
+
+    for i, df in enumerate(label_chunks(read_chunks(file, chunksize), scaler, model)):
+        df.to_csv(output, index=False, header=(i == 0))
+
+        rows += df.shape[0]
+        # dict keeps the first-seen order of the cities, like Series.unique
+        # the same str() names dashboard.by_city groups by, so a blank city is 'nan' in both
+        cities.update(dict.fromkeys(df['nama_kota'].to_numpy(dtype=object).astype(str).tolist()))
+
+    if rows == 0:
+        raise SchemaError("File belum berisi data! ")
+
+    output.seek(0)
+    return output, rows, list(cities)
+
+def read_labeled_chunks(source, chunksize=CHUNK_ROWS, usecols=None):
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    # labels come back as the shared categorical rather than one Python string per row
+    return pd.read_csv(source, chunksize=chunksize, usecols=usecols, dtype={'label': LABEL_DTYPE})
+
+def list_cities(source, chunksize=CHUNK_ROWS):
+
+    cities = {}
+    for df in read_labeled_chunks(source, chunksize, usecols=['nama_kota']):
+        # the same str() names dashboard.by_city groups by, so a blank city is 'nan' in both
+        cities.update(dict.fromkeys(df['nama_kota'].to_numpy(dtype=object).astype(str).tolist()))
+
+    return list(cities)
@@ -0,0 +1,198 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# process-wide switch; sessions can also turn recording on just for themselves
+ENABLED = os.getenv("AIR_QUALITY_INSTRUMENTATION") == "1"
+
+RING_SIZE = 2000
+
+_records = deque(maxlen=RING_SIZE)
+_lock = threading.Lock()
+
+# set for the duration of one instrumented run (one Streamlit script run, one request, ...)
+_session = contextvars.ContextVar('instrumentation_session', default=None)
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+class Stage:
+
+    def __init__(self, name, rows=None):
+
+        self.name = name
+        self.rows = rows
+
+def rss_bytes():
+
+    # current resident set size; /proc is cheap to read and Linux is where the app is deployed
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def enabled():
+    return ENABLED or _session.get() is not None
+
+def enable(on=True):
+
+    global ENABLED
+    ENABLED = on
+
+@contextmanager
+def stage(name, rows=None):
+
+    if not enabled():
+        yield Stage(name, rows)
+        return
+
+    current = Stage(name, rows)
+    memory_before = rss_bytes()
+    started = time.perf_counter()
+
+    try:
+        yield current
+
+    finally:
+        seconds = time.perf_counter() - started
+        memory_after = rss_bytes()
+
+        record = {'stage': name,
+                  'seconds': seconds,
+                  'rows': current.rows,
+                  'memory_delta': None if memory_before is None or memory_after is None
+                                  else memory_after - memory_before,
+                  'timestamp': time.time()}
+
+        with _lock:
+            _records.append(record)
+
+        session = _session.get()
+        if session is not None:
+            session.append(record)
+
+def timed(name, rows=None):
+
+    # rows, when given, maps the call's arguments to a row count
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+
+            if not enabled():
+                return function(*args, **kwargs)
+
+            with stage(name, rows(*args, **kwargs) if rows else None):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+@contextmanager
+def session():
+
+    records = []
+    token = _session.set(records)
+
+    try:
+        yield records
+    finally:
+        _session.reset(token)
+
+def records():
+
+    with _lock:
+        return list(_records)
+
+def clear():
+
+    with _lock:
+        _records.clear()
+
+def summary(items=None):
+
+    items = records() if items is None else items
+    result = {}
+
+    for record in items:
+        entry = result.setdefault(record['stage'], {'count': 0,
+                                                     'seconds_total': 0.0,
+                                                     'seconds_max': 0.0,
+                                                     'rows_total': 0})
+        entry['count'] += 1
+        entry['seconds_total'] += record['seconds']
+        entry['seconds_max'] = max(entry['seconds_max'], record['seconds'])
+        entry['rows_total'] += record['rows'] or 0
+
+    for entry in result.values():
+        entry['seconds_mean'] = entry['seconds_total'] / entry['count']
+
+    return result
+
+def to_json(items=None):
+    return json.dumps({'records': records() if items is None else items,
+                       'summary': summary(items)}, indent=2)
+
+def to_prometheus(items=None):
+
+    lines = ["# TYPE air_quality_stage_seconds summary",
+             "# TYPE air_quality_stage_rows counter"]
+
+    for name, entry in sorted(summary(items).items()):
+        label = name.replace('\\', '\\\\').replace('"', '\\"')
+        lines.append(f'air_quality_stage_seconds_count{{stage="{label}"}} {entry["count"]}')
+        lines.append(f'air_quality_stage_seconds_sum{{stage="{label}"}} {entry["seconds_total"]}')
+        lines.append(f'air_quality_stage_rows{{stage="{label}"}} {entry["rows_total"]}')
+
+    return "\n".join(lines) + "\n"
+
+@contextmanager
+def profile(kind='cprofile'):
+
+    # yields a dict whose 'report' is filled in with a text report once the block finishes
+    result = {'kind': kind, 'report': None, 'note': None}
+
+    if kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            # optional and not in requirements.txt; cProfile ships with Python
+            result['kind'] = 'cprofile'
+            result['note'] = "pyinstrument tidak terpasang, laporan memakai cProfile."
+
+    if result['kind'] == 'pyinstrument':
+        profiler = Profiler()
+        profiler.start()
+
+        try:
+            yield result
+        finally:
+            profiler.stop()
+            result['report'] = profiler.output_text()
+
+        return
+
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield result
+    finally:
+        profiler.disable()
+
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+        result['report'] = output.getvalue()
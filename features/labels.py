@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+CATEGORY = {0: 'BAIK',
+            1: 'SEDANG',
+            2: 'TIDAK SEHAT',
+            3: 'SANGAT TIDAK SEHAT'}
+
+# ordered, so sorting and comparisons follow the severity rather than the alphabet
+LABEL_DTYPE = pd.CategoricalDtype(list(CATEGORY.values()), ordered=True)
+
+CODE_DTYPE = np.int8
+
+def to_categorical(codes):
+
+    # the codes are stored as-is; the names only exist once in the dtype
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=CODE_DTYPE), dtype=LABEL_DTYPE)
+
+def encode(labels):
+
+    # int8 codes from model output, a categorical column, or label names read back from a file
+    if isinstance(labels, np.ndarray) and labels.dtype.kind in 'iu':
+        return labels.astype(CODE_DTYPE, copy=False)
+
+    labels = pd.Series(labels)
+
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        return labels.astype(LABEL_DTYPE).cat.codes.to_numpy(dtype=CODE_DTYPE)
+
+    if pd.api.types.is_numeric_dtype(labels):
+        return labels.to_numpy(dtype=CODE_DTYPE)
+
+    return labels.astype(LABEL_DTYPE).cat.codes.to_numpy(dtype=CODE_DTYPE)
+
+def names(codes):
+    return [CATEGORY[int(i)] for i in codes]
+
+def chart_names(codes):
+
+    # '0:BAIK'-style names, which the charts sort into severity order
+    return [f"{int(i)}:{CATEGORY[int(i)]}" for i in codes]
@@ -1,5 +1,15 @@
-import pandas as pd
 import numpy as np
+from features.spatial_index import ManhattanKDTree
+from features.compact_store import load_compact
+from features.instrumentation import timed
+
+# keeps exact duplicates of a training row from dividing by zero
+WEIGHT_EPSILON = 1e-9
+
+# neighbor weights as a function of their distances; None is one vote per neighbor
+WEIGHTINGS = {'uniform': None,
+              'inverse': lambda distance: 1 / (distance + WEIGHT_EPSILON),
+              'inverse_square': lambda distance: 1 / (distance + WEIGHT_EPSILON) ** 2}
 
 class MinMaxScaler:
 
@@ -8,6 +18,7 @@ class MinMaxScaler:
         self.min = np.array([3.0, 16.0, 11.0, 1.0, 4.0, 0.0])
         self.max = np.array([163.0, 287.0, 89.0, 55.0, 81.0, 53.0])
 
+    @timed('scaler.transform', rows=lambda self, x: len(x))
     def transform(self, x):
         
         x_scaled = (x - self.min) / (self.max - self.min)
@@ -15,6 +26,20 @@ class MinMaxScaler:
 
         return x_scaled
 
+    @timed('scaler.transform', rows=lambda self, columns, out=None: len(columns[0]) if len(columns) else 0)
+    def transform_columns(self, columns, out=None):
+
+        # one 1-D float buffer per feature (e.g. Arrow columns viewed in place) scaled straight
+        # into a column-major matrix, so the raw rows are never stacked first; same values as transform
+        if out is None:
+            out = np.empty((len(columns[0]) if len(columns) else 0, len(self.min)), order='F')
+
+        for j, column in enumerate(columns):
+            np.subtract(column, self.min[j], out=out[:, j])
+            np.divide(out[:, j], self.max[j] - self.min[j], out=out[:, j])
+
+        return out
+
     def inverse_transform(self, x_scaled):
         
         x_original = (x_scaled - 0) / (1 - 0)
@@ -22,31 +47,154 @@ class MinMaxScaler:
     
 class ManhattanKNN:
 
-    def __init__(self):
+    def __init__(self, memory_budget=1024 ** 2, index='brute', mmap_mode=None,
+                 x_path='features/x.npy', y_path='features/y.npy', compact_path=None,
+                 n_neighbors=2, weighting='uniform'):
         
-        self.x_train = np.load('features/x.npy')
-        self.y_train = np.load('features/y.npy')
+        if compact_path is not None:
+            # features stay in their compact dtype; test blocks are brought to the same scale instead
+            self.x_train, self.y_train, self.header = load_compact(compact_path, MinMaxScaler())
+            self.x_scale = self.header['scale']
+            self.distance_dtype = np.dtype(np.float64 if self.header['dtype'] == 'float64' else np.float32)
+        else:
+            self.x_train = np.load(x_path, mmap_mode=mmap_mode)
+            self.y_train = np.load(y_path, mmap_mode=mmap_mode)
+            self.header = None
+            self.x_scale = 1.0
+            self.distance_dtype = np.dtype(np.float64)
+
+        self.n = n_neighbors
+
+        if weighting not in WEIGHTINGS:
+            raise ValueError(f"Unknown weighting: {weighting}")
+
+        self.weighting = weighting
+
+        # bytes allowed for one block of the (test rows x train rows) distance matrix
+        self.memory_budget = memory_budget
 
-        self.n = 2
+        # 'brute' stays the default; 'kdtree' gives the same neighbors (benchmarks/check_kdtree.py)
+        # and pulls ahead as the training set grows
+        if index not in ('brute', 'kdtree'):
+            raise ValueError(f"Unknown index backend: {index}")
+
+        self.index = index
+        self.fit(self.x_train, self.y_train)
+
+    def fit(self, x_train, y_train):
+
+        # swaps the training set in place, in the same scale and dtype as the loaded one
+        self.x_train = x_train
+        self.y_train = y_train
+
+        # one contiguous array per feature keeps the blocked distance kernel cache friendly
+        self.x_train_columns = np.ascontiguousarray(self.x_train.T)
+        self.tree = ManhattanKDTree(self.x_train / self.x_scale) if self.index == 'kdtree' else None
+
+        return self
 
     def distance_metric(self, x):
-        return np.sum(np.abs(self.x_train - x), axis=1)
+        return np.sum(np.abs(self.x_train / self.x_scale - x), axis=1)
+
+    def chunk_size(self):
+
+        # the distance block and one temporary of the same shape are alive at once
+        row_bytes = 2 * self.x_train.shape[0] * self.distance_dtype.itemsize
+        return max(1, int(self.memory_budget // row_bytes))
+
+    def distance_block(self, x_block):
+
+        x_block = (x_block * self.x_scale).astype(self.distance_dtype, copy=False)
+        distance = np.zeros((x_block.shape[0], self.x_train.shape[0]), dtype=self.distance_dtype)
+        buffer = np.empty_like(distance)
+
+        for j in range(self.x_train.shape[1]):
+            np.subtract(x_block[:, j, None], self.x_train_columns[j], out=buffer)
+            np.abs(buffer, out=buffer)
+            distance += buffer
 
+        return distance
+
+    def nearest_neighbors(self, distance):
+
+        n = min(self.n, distance.shape[1])
+        rows = np.arange(distance.shape[0])[:, None]
+
+        if n < distance.shape[1]:
+            candidates = np.argpartition(distance, n - 1, axis=1)[:, :n]
+        else:
+            candidates = np.broadcast_to(np.arange(distance.shape[1]), distance.shape)
+
+        # order the k candidates by (distance, train index) so ties resolve the same way every run
+        order = np.lexsort((candidates, distance[rows, candidates]), axis=1)
+        return candidates[rows, order]
+
+    def neighbor_distances(self, x_block, nearest_neighbors):
+
+        # accumulated column by column like distance_block, so both give bit-identical distances
+        x_block = (x_block * self.x_scale).astype(self.distance_dtype, copy=False)
+        distance = np.zeros(nearest_neighbors.shape, dtype=self.distance_dtype)
+
+        for j in range(self.x_train.shape[1]):
+            distance += np.abs(x_block[:, j, None] - self.x_train_columns[j][nearest_neighbors])
+
+        return distance
+
+    def vote(self, classes, distances=None):
+
+        n_rows, n = classes.shape
+        n_classes = int(self.y_train.max()) + 1
+        rows = np.arange(n_rows)
+
+        if self.weighting != 'uniform':
+            weights = WEIGHTINGS[self.weighting](np.asarray(distances, dtype=np.float64))
+            scores = np.zeros((n_rows, n_classes))
+            first_seen = np.full((n_rows, n_classes), n, dtype=np.int64)
+
+            for rank in range(n):
+                scores[rows, classes[:, rank]] += weights[:, rank]
+                first_seen[rows, classes[:, rank]] = np.minimum(first_seen[rows, classes[:, rank]], rank)
+
+            # heaviest class wins, exact ties go to the class whose first neighbor is nearest
+            tied = scores == scores.max(axis=1, keepdims=True)
+            return np.argmin(np.where(tied, first_seen, n), axis=1)
+
+        counts = np.zeros((n_rows, n_classes), dtype=np.int64)
+        first_seen = np.full((n_rows, n_classes), n, dtype=np.int64)
+
+        # walk the neighbor ranks from farthest to nearest so the nearest rank wins first_seen
+        for rank in range(n - 1, -1, -1):
+            counts[rows, classes[:, rank]] += 1
+            first_seen[rows, classes[:, rank]] = rank
+
+        # most votes wins, ties go to the class whose first neighbor is nearest
+        return np.argmax(counts * (n + 1) - first_seen, axis=1)
+
+    @timed('knn.predict', rows=lambda self, x_test: int(np.size(x_test) // self.x_train.shape[1]))
     def predict(self, x_test):
         
-        result = []
-        x_test = np.array(x_test)
+        x_test = np.asarray(x_test, dtype=np.float64).reshape(-1, self.x_train.shape[1])
+        result = np.empty(x_test.shape[0], dtype=np.int8)
 
-        for x in x_test:
-            class_dict = {}
+        if self.x_train.shape[0] == 0:
+            raise ValueError("ManhattanKNN has no training rows to predict from")
 
-            distance = self.distance_metric(x)
-            nearest_neighbors = np.argsort(distance)[:self.n]
-            classes = self.y_train[nearest_neighbors].astype(int)
+        # the tree sizes its own query blocks; the budget only bounds the brute-force distance matrix
+        step = self.chunk_size() if self.tree is None else max(1, x_test.shape[0])
+
+        for start in range(0, x_test.shape[0], step):
+            stop = start + step
 
-            for cls in classes:
-                class_dict[cls] = class_dict.get(cls, 0) + 1
+            if self.tree is not None:
+                nearest_neighbors = self.tree.query(x_test[start:stop], self.n)
+            else:
+                distance = self.distance_block(x_test[start:stop])
+                nearest_neighbors = self.nearest_neighbors(distance)
+
+            classes = self.y_train[nearest_neighbors].astype(int)
+            distances = None if self.weighting == 'uniform' \
+                            else self.neighbor_distances(x_test[start:stop], nearest_neighbors)
 
-            result.append(max(class_dict, key=class_dict.get))
+            result[start:stop] = self.vote(classes, distances)
 
-        return result
\ No newline at end of file
+        return result
@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from features.export import write_atomic
+from features.instrumentation import stage
+from features.machine_learning import ManhattanKNN, WEIGHTINGS
+
+CACHE_DIR = os.getenv("AIR_QUALITY_CACHE_DIR", ".cache")
+
+DEFAULT_MAX_K = 25
+
+def dataset_hash(model):
+
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(model.x_train).tobytes())
+    digest.update(np.ascontiguousarray(model.y_train).tobytes())
+    digest.update(repr((model.x_scale, str(model.distance_dtype))).encode())
+
+    return digest.hexdigest()
+
+def graph_path(model, max_k, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"neighbors_{dataset_hash(model)[:16]}_{max_k}.npz")
+
+def build_graph(model, max_k):
+
+    # top-K neighbors of every training row among the other rows, ordered by (distance, index)
+    x = np.asarray(model.x_train, dtype=np.float64) / model.x_scale
+    n_rows = x.shape[0]
+    max_k = min(max_k, n_rows - 1)
+
+    indices = np.empty((n_rows, max_k), dtype=np.int32)
+    distances = np.empty((n_rows, max_k), dtype=model.distance_dtype)
+    step = model.chunk_size()
+
+    for start in range(0, n_rows, step):
+        stop = min(start + step, n_rows)
+        rows = np.arange(stop - start)[:, None]
+
+        distance = model.distance_block(x[start:stop])
+        distance[rows[:, 0], np.arange(start, stop)] = np.inf
+
+        candidates = np.argpartition(distance, max_k - 1, axis=1)[:, :max_k]
+        order = np.lexsort((candidates, distance[rows, candidates]), axis=1)
+        candidates = candidates[rows, order]
+
+        indices[start:stop] = candidates
+        distances[start:stop] = distance[rows, candidates]
+
+    return indices, distances
+
+def get_graph(model, max_k=DEFAULT_MAX_K, cache_dir=CACHE_DIR):
+
+    path = graph_path(model, max_k, cache_dir)
+
+    if os.path.exists(path):
+        with np.load(path) as store:
+            return store['indices'], store['distances']
+
+    with stage('evaluation.graph', rows=model.x_train.shape[0]):
+        indices, distances = build_graph(model, max_k)
+
+    # a concurrent reader never sees half a graph
+    write_atomic(path, lambda f: np.savez(f, indices=indices, distances=distances))
+
+    return indices, distances
+
+def sweep(classes, distances, weighting, n_classes):
+
+    # leave-one-out predictions for every k <= K from one walk over the neighbor ranks,
+    # with the same scores and tie breaks as ManhattanKNN.vote
+    n_rows, max_k = classes.shape
+    rows = np.arange(n_rows)
+
+    weight = WEIGHTINGS[weighting]
+    weights = None if weight is None else weight(np.asarray(distances, dtype=np.float64))
+
+    scores = np.zeros((n_rows, n_classes), dtype=np.int64 if weights is None else np.float64)
+    first_seen = np.full((n_rows, n_classes), max_k, dtype=np.int64)
+    predictions = np.empty((max_k, n_rows), dtype=np.int8)
+
+    for rank in range(max_k):
+        column = classes[:, rank]
+
+        scores[rows, column] += 1 if weights is None else weights[:, rank]
+        first_seen[rows, column] = np.minimum(first_seen[rows, column], rank)
+
+        k = rank + 1
+
+        if weights is None:
+            # unseen classes score below any seen one, so their first_seen value does not matter
+            predictions[rank] = np.argmax(scores * (k + 1) - np.minimum(first_seen, k), axis=1)
+        else:
+            tied = scores == scores.max(axis=1, keepdims=True)
+            predictions[rank] = np.argmin(np.where(tied, first_seen, k), axis=1)
+
+    return predictions
+
+def metrics(y_true, y_pred, n_classes):
+
+    confusion = np.zeros((n_classes, n_classes), dtype=np.int64)
+    np.add.at(confusion, (y_true, y_pred), 1)
+
+    support = confusion.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recall = np.diag(confusion) / support
+
+    return {'accuracy': float(np.trace(confusion) / confusion.sum()),
+            'confusion': confusion.tolist(),
+            'recall': [None if np.isnan(i) else float(i) for i in recall]}
+
+def evaluate(model, max_k=DEFAULT_MAX_K, weightings=tuple(WEIGHTINGS), cache_dir=CACHE_DIR):
+
+    indices, distances = get_graph(model, max_k, cache_dir)
+
+    y_train = np.asarray(model.y_train).astype(np.int64)
+    n_classes = int(y_train.max()) + 1
+    classes = y_train[indices]
+
+    results = []
+
+    for weighting in weightings:
+        predictions = sweep(classes, distances, weighting, n_classes)
+
+        for rank, y_pred in enumerate(predictions):
+            results.append({'k': rank + 1,
+                            'weighting': weighting,
+                            **metrics(y_train, y_pred.astype(np.int64), n_classes)})
+
+    return results
+
+def best(results):
+
+    # highest accuracy; among equals the smaller k, then the simpler weighting order given
+    return max(results, key=lambda i: (i['accuracy'], -i['k']))
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Leave-one-out evaluation and k selection for ManhattanKNN.")
+    parser.add_argument('--max-k', type=int, default=DEFAULT_MAX_K)
+    parser.add_argument('--weighting', action='append', choices=sorted(WEIGHTINGS),
+                        help="voting scheme to evaluate; repeat for several, default all")
+    parser.add_argument('--compact-path', default=None)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', default=None, help="write every k/weighting result as JSON")
+    args = parser.parse_args(argv)
+
+    model = ManhattanKNN(compact_path=args.compact_path)
+    weightings = args.weighting or list(WEIGHTINGS)
+
+    started = time.perf_counter()
+    results = evaluate(model, args.max_k, weightings, args.cache_dir)
+    seconds = time.perf_counter() - started
+
+    by_k = {}
+    for i in results:
+        by_k.setdefault(i['k'], {})[i['weighting']] = i['accuracy']
+
+    print(f"{'k':>3} " + " ".join(f"{i:>15}" for i in weightings))
+    for k, row in sorted(by_k.items()):
+        print(f"{k:>3} " + " ".join(f"{row[i]:15.4f}" for i in weightings))
+
+    chosen = best(results)
+    print(f"best: k={chosen['k']} weighting={chosen['weighting']} accuracy={chosen['accuracy']:.4f} "
+          f"recall={[round(i, 4) if i is not None else None for i in chosen['recall']]} ({seconds:.2f}s)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'max_k': args.max_k, 'results': results, 'best': chosen}, f, indent=2)
+
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
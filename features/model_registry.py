@@ -0,0 +1,122 @@
+import os
+import threading
+from features.machine_learning import MinMaxScaler, ManhattanKNN
+from features.prediction_cache import CachedPredictor
+from features.instrumentation import stage
+
+X_PATH = 'features/x.npy'
+Y_PATH = 'features/y.npy'
+
+# a table built by features/decision_table.py; when set, and the table measured fast enough when it was
+# built, predictors answer from it and fall back to the cached model
+DECISION_TABLE = os.getenv("AIR_QUALITY_DECISION_TABLE") or None
+
+_lock = threading.Lock()
+_models = {}
+_predictors = {}
+_scaler = None
+
+# called with the old model whenever a model is rebuilt because its files changed
+_reload_hooks = []
+
+def file_signature(*paths):
+
+    # mtime and size are enough to notice a retrained x.npy/y.npy being dropped in place
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(signature)
+
+def get_model(index='brute', compact_path=None):
+
+    if compact_path is not None:
+        signature = file_signature(compact_path)
+    else:
+        signature = file_signature(X_PATH, Y_PATH)
+
+    key = (index, compact_path)
+
+    with _lock:
+        entry = _models.get(key)
+
+        if entry is None or entry[0] != signature:
+
+            if entry is not None:
+                for hook in _reload_hooks:
+                    hook(entry[1])
+
+            # memory-mapped so every Streamlit worker process shares the same pages from the OS cache
+            with stage('model.load'):
+                model = ManhattanKNN(index=index,
+                                     mmap_mode='r',
+                                     x_path=X_PATH,
+                                     y_path=Y_PATH,
+                                     compact_path=compact_path)
+            entry = (signature, model)
+            _models[key] = entry
+
+        return entry[1]
+
+def on_reload(hook):
+    _reload_hooks.append(hook)
+
+def get_predictor(index='brute', compact_path=None, precision=6, max_size=100_000, table_path=DECISION_TABLE):
+
+    model = get_model(index, compact_path)
+    key = (index, compact_path, precision, max_size, table_path)
+
+    with _lock:
+        predictor = _predictors.get(key)
+
+        # a predictor wrapping an outdated model would serve stale labels, so it is replaced
+        if predictor is None or predictor.model is not model:
+            predictor = CachedPredictor(model, precision, max_size)
+
+            if table_path is not None:
+                from features.decision_table import CompiledPredictor, load_table, pays_off
+
+                with stage('model.load_table'):
+                    table = load_table(table_path, model)
+
+                if pays_off(table):
+                    predictor = CompiledPredictor(model, table, predictor)
+                else:
+                    print(f"Decision table {table_path} not used: measured speedup {table.speedup} "
+                          f"at hit rate {table.hit_rate}")
+
+            _predictors[key] = predictor
+
+        return predictor
+
+def invalidate_predictors(old_model):
+
+    # runs under _lock from get_model; drops every cached label computed by the old model
+    for predictor in list(_predictors.values()):
+        if predictor.model is old_model:
+            predictor.invalidate()
+
+on_reload(invalidate_predictors)
+
+def get_scaler():
+
+    global _scaler
+
+    with _lock:
+        if _scaler is None:
+            _scaler = MinMaxScaler()
+
+        return _scaler
+
+def model_version():
+    return file_signature(X_PATH, Y_PATH)
+
+def clear():
+
+    global _scaler
+
+    with _lock:
+        _models.clear()
+        _predictors.clear()
+        _scaler = None
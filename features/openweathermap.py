@@ -0,0 +1,129 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from features.instrumentation import timed
+
+# overridable so the pages can be pointed at a local stub server
+BASE_URL = os.getenv("OWM_BASE_URL", "http://api.openweathermap.org/data/2.5")
+
+# (connect, read) seconds; history responses for a whole year can take a while to arrive
+TIMEOUT = (5, 60)
+
+MAX_WORKERS = 8
+
+# history ranges are split into windows of this many seconds and fetched in parallel
+WINDOW = 30 * 86400
+WINDOW_WORKERS = 4
+
+RETRY = Retry(total=4,
+              backoff_factor=0.5,
+              status_forcelist=(429, 500, 502, 503, 504),
+              allowed_methods=("GET",),
+              respect_retry_after_header=True,
+              raise_on_status=False)
+
+# what reading a response without the expected entries raises (JSON decode errors are ValueErrors)
+MALFORMED = (KeyError, IndexError, ValueError)
+
+_lock = threading.Lock()
+_session = None
+
+def get_session():
+
+    global _session
+
+    with _lock:
+        if _session is None:
+            # one pooled session per process, sized so every worker keeps its connection alive
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS,
+                                  pool_maxsize=MAX_WORKERS * WINDOW_WORKERS,
+                                  max_retries=RETRY)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+
+        return _session
+
+@timed('owm.request')
+def get_json(path, params):
+
+    response = get_session().get(f"{BASE_URL}/{path}", params=params, timeout=TIMEOUT)
+    response.raise_for_status()
+
+    return response.json()
+
+def get_current_reading(latitude,
+                        longitude,
+                        api_key):
+
+    # the whole current entry, so callers also get its observation time ('dt')
+    params = {
+        'lat': latitude,
+        'lon': longitude,
+        'appid': api_key
+    }
+
+    try:
+
+        data = get_json("air_pollution", params)
+        return data['list'][0]
+
+    except requests.exceptions.RequestException as e:
+
+        print(f"Error fetching air pollution data: {e}")
+        return None
+
+    # an empty or malformed 'list' for one location is treated like a failed request
+    except MALFORMED as e:
+
+        print(f"Unexpected air pollution response: {e!r}")
+        return None
+
+def get_hourly_air_pollution(latitude,
+                             longitude,
+                             start_ts,
+                             end_ts,
+                             api_key):
+
+    params = {
+        'lat': latitude,
+        'lon': longitude,
+        'start': start_ts,
+        'end': end_ts,
+        'appid': api_key
+    }
+
+    data = get_json("air_pollution/history", params).get('list', [])
+    return data
+
+def split_range(start_ts, end_ts, window=WINDOW):
+
+    # inclusive [start, end] windows that tile the range without overlapping
+    return [(start, min(start + window - 1, end_ts))
+            for start in range(int(start_ts), int(end_ts) + 1, int(window))]
+
+def fetch_many(fetch, arguments, max_workers=MAX_WORKERS):
+
+    def run(args):
+
+        try:
+            return fetch(*args)
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching air pollution data: {e}")
+            return None
+
+        # one location's bad payload must not take the other locations down with it
+        except MALFORMED as e:
+            print(f"Unexpected air pollution response: {e!r}")
+            return None
+
+    # results come back in the order of arguments; failed calls are None. Each call runs in a copy
+    # of the caller's context, so its stages still land in the caller's instrumentation session
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, run, args) for args in arguments]
+        return [future.result() for future in futures]
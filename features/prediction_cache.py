@@ -0,0 +1,99 @@
+import threading
+import numpy as np
+from features.instrumentation import timed
+
+class CachedPredictor:
+
+    def __init__(self, model, precision=6, max_size=100_000):
+
+        self.model = model
+        self.precision = precision
+        self.max_size = max_size
+
+        # a reading's rounded features as one opaque scalar, so whole rows sort and compare as bytes
+        n_features = self.model.x_train.shape[1]
+        self.key_dtype = np.dtype((np.void, n_features * np.dtype(np.float64).itemsize))
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidate()
+
+    def invalidate(self):
+
+        # sorted keys with their labels and the tick each was last used at, for LRU eviction
+        with self.lock:
+            self.keys = np.empty(0, dtype=self.key_dtype)
+            self.labels = np.empty(0, dtype=np.int8)
+            self.used = np.empty(0, dtype=np.int64)
+            self.tick = 0
+
+    def stats(self):
+
+        with self.lock:
+            return {'size': self.keys.shape[0],
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+    def find(self, keys):
+
+        # position of each key in the sorted cache, and whether it is actually there
+        slot = np.searchsorted(self.keys, keys)
+        found = slot < self.keys.shape[0]
+        found[found] = self.keys[slot[found]] == keys[found]
+
+        return slot, found
+
+    @timed('predict.cached', rows=lambda self, x_test: len(x_test))
+    def predict(self, x_test):
+
+        n_features = self.model.x_train.shape[1]
+        x_test = np.asarray(x_test, dtype=np.float64).reshape(-1, n_features)
+
+        if x_test.shape[0] == 0:
+            return np.empty(0, dtype=np.int8)
+
+        # readings that agree to `precision` decimals in the scaled space share one prediction;
+        # adding 0.0 turns -0.0 into 0.0 so both share the same bytes
+        keys = np.ascontiguousarray(np.round(x_test, self.precision) + 0.0).view(self.key_dtype).reshape(-1)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        labels = np.empty(unique.shape[0], dtype=np.int8)
+
+        with self.lock:
+            slot, found = self.find(unique)
+            labels[found] = self.labels[slot[found]]
+
+            self.tick += 1
+            self.used[slot[found]] = self.tick
+
+            self.hits += int(found.sum())
+            self.misses += int(unique.shape[0] - found.sum())
+
+        missing = ~found
+
+        if missing.any():
+            new = unique[missing]
+            labels[missing] = self.model.predict(new.view(np.float64).reshape(-1, n_features))
+
+            with self.lock:
+                # another thread may have stored some of them in the meantime
+                slot, found = self.find(new)
+                self.tick += 1
+
+                self.keys = np.insert(self.keys, slot[~found], new[~found])
+                self.labels = np.insert(self.labels, slot[~found], labels[missing][~found])
+                self.used = np.insert(self.used, slot[~found], self.tick)
+
+                # drop the least recently used entries, keeping the rest sorted
+                excess = self.keys.shape[0] - self.max_size
+                if excess > 0:
+                    stale = np.argpartition(self.used, excess - 1)[:excess]
+                    self.keys = np.delete(self.keys, stale)
+                    self.labels = np.delete(self.labels, stale)
+                    self.used = np.delete(self.used, stale)
+
+        # scatter the unique results back to every input row
+        return labels[inverse]
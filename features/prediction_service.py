@@ -0,0 +1,267 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from features.labels import CATEGORY
+from features.model_registry import get_predictor, get_scaler
+
+# OpenWeatherMap-style keys are accepted as well as the column names used in uploads
+FIELDS = [('pm10', 'pm10'),
+          ('pm2.5', 'pm2_5'),
+          ('so2', 'so2'),
+          ('co', 'co'),
+          ('o3', 'o3'),
+          ('no2', 'no2')]
+
+# upper bounds in milliseconds; the last bucket catches everything slower
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, float('inf'))
+
+MAX_BODY = 64 * 1024 ** 2
+
+class Histogram:
+
+    def __init__(self, buckets):
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+        self.total += value
+        self.n += 1
+
+    def to_dict(self):
+        return {'buckets': [str(i) for i in self.buckets],
+                'counts': list(self.counts),
+                'sum': self.total,
+                'count': self.n}
+
+class Metrics:
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.batch_size = Histogram((1, 2, 4, 8, 16, 32, 64, 128, 256, 512, float('inf')))
+        self.requests = 0
+        self.errors = 0
+
+    def observe_request(self, endpoint, seconds, ok=True):
+
+        with self.lock:
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(seconds * 1000)
+            self.requests += 1
+            self.errors += 0 if ok else 1
+
+    def observe_batch(self, size):
+
+        with self.lock:
+            self.batch_size.observe(size)
+
+    def to_dict(self, queue_depth):
+
+        with self.lock:
+            return {'requests': self.requests,
+                    'errors': self.errors,
+                    'queue_depth': queue_depth,
+                    'latency_ms': {endpoint: histogram.to_dict()
+                                   for endpoint, histogram in self.latency.items()},
+                    'batch_size': self.batch_size.to_dict()}
+
+class MicroBatcher:
+
+    def __init__(self, model, scaler, max_batch=256, max_wait=0.005):
+
+        self.model = model
+        self.scaler = scaler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.metrics = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, row):
+
+        future = Future()
+        self.queue.put((row, future))
+        return future
+
+    def collect(self):
+
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        # keep taking rows until the batch is full or the latency window closes
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+
+        while True:
+            batch = self.collect()
+            rows = np.array([row for row, _ in batch], dtype=np.float64)
+
+            try:
+                labels = self.model.predict(self.scaler.transform(rows))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            if self.metrics is not None:
+                self.metrics.observe_batch(len(batch))
+
+            for (_, future), label in zip(batch, labels):
+                future.set_result(int(label))
+
+def parse_row(item):
+
+    if isinstance(item, dict):
+        try:
+            return [float(item[column] if column in item else item[key]) for column, key in FIELDS]
+        except KeyError as e:
+            raise ValueError(f"Missing field: {e.args[0]}")
+
+    row = [float(i) for i in item]
+    if len(row) != len(FIELDS):
+        raise ValueError(f"Expected {len(FIELDS)} values, got {len(row)}")
+
+    return row
+
+def label_response(label):
+    return {'label': label, 'category': CATEGORY[label]}
+
+class PredictionHandler(BaseHTTPRequestHandler):
+
+    server_version = "PrediksiKualitasUdara/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+
+        body = json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ValueError("Request body too large")
+
+        return json.loads(self.rfile.read(length) or b'null')
+
+    def do_GET(self):
+
+        if self.path == '/metrics':
+            self.send_json(200, self.server.metrics.to_dict(self.server.batcher.queue.qsize()))
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+
+        started = time.perf_counter()
+        ok = False
+
+        try:
+            payload = self.read_json()
+
+            if self.path == '/predict':
+                # single readings wait in the micro-batch queue with everyone else's
+                label = self.server.batcher.submit(parse_row(payload)).result()
+                self.send_json(200, label_response(label))
+
+            elif self.path == '/predict/batch':
+                items = payload.get('rows') if isinstance(payload, dict) else payload
+                if not isinstance(items, list):
+                    raise ValueError("Expected a list of readings")
+
+                rows = np.array([parse_row(i) for i in items], dtype=np.float64).reshape(-1, len(FIELDS))
+                labels = self.server.model.predict(self.server.scaler.transform(rows))
+                self.send_json(200, {'predictions': [label_response(int(i)) for i in labels]})
+
+            else:
+                self.send_json(404, {'error': 'Not found'})
+                return
+
+            ok = True
+
+        except (ValueError, TypeError, json.JSONDecodeError) as e:
+            self.send_json(400, {'error': str(e)})
+
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+        finally:
+            self.server.metrics.observe_request(self.path, time.perf_counter() - started, ok)
+
+class PredictionServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    # the stdlib default of 5 drops connections as soon as a burst of callers arrives
+    request_queue_size = 128
+
+def make_server(host='127.0.0.1', port=8502, max_batch=256, max_wait=0.005):
+
+    server = PredictionServer((host, port), PredictionHandler)
+
+    # one model per process, shared by the batcher and the batch endpoint
+    server.model = get_predictor()
+    server.scaler = get_scaler()
+    server.metrics = Metrics()
+    server.batcher = MicroBatcher(server.model, server.scaler, max_batch, max_wait)
+    server.batcher.metrics = server.metrics
+
+    return server
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Serve air quality predictions over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.max_batch, args.max_wait_ms / 1000)
+    print(f"Serving predictions on http://{args.host}:{server.server_port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import json
+import time
+import numpy as np
+from features.compact_store import save_compact
+from features.machine_learning import MinMaxScaler, ManhattanKNN
+
+# training rows checked against the growing prototype set before it is refreshed
+CONDENSE_BLOCK = 64
+
+# spread, in scaled units, of the probe points drawn around the training rows
+PROBE_JITTER = 0.02
+
+def leave_one_out(model):
+
+    # each training row voted on by its k nearest *other* rows, with the model's own kernel and vote
+    x = np.asarray(model.x_train, dtype=np.float64) / model.x_scale
+    labels = np.empty(x.shape[0], dtype=np.int8)
+    step = model.chunk_size()
+
+    for start in range(0, x.shape[0], step):
+        stop = min(start + step, x.shape[0])
+
+        distance = model.distance_block(x[start:stop])
+        distance[np.arange(stop - start), np.arange(start, stop)] = np.inf
+
+        neighbors = model.nearest_neighbors(distance)
+        classes = model.y_train[neighbors].astype(int)
+
+        # weighted votes need the neighbours' distances, as in ManhattanKNN.predict
+        distances = None if model.weighting == 'uniform' else model.neighbor_distances(x[start:stop], neighbors)
+        labels[start:stop] = model.vote(classes, distances)
+
+    return labels
+
+def edit(model):
+
+    # Wilson's edited nearest neighbour: drop rows their own neighbours outvote
+    return np.flatnonzero(leave_one_out(model) == np.asarray(model.y_train))
+
+def condense(model, candidates, block=CONDENSE_BLOCK):
+
+    # Hart's condensed nearest neighbour, run until a full pass adds nothing
+    x_train = model.x_train
+    y_train = model.y_train
+    candidates = np.asarray(candidates)
+
+    # seed with the first candidate of every class so each label can be predicted
+    _, first = np.unique(np.asarray(y_train)[candidates], return_index=True)
+    selected = np.zeros(x_train.shape[0], dtype=bool)
+    selected[candidates[first]] = True
+
+    try:
+        changed = True
+
+        while changed:
+            changed = False
+
+            for start in range(0, candidates.shape[0], block):
+                rows = candidates[start:start + block]
+                rows = rows[~selected[rows]]
+
+                if rows.shape[0] == 0:
+                    continue
+
+                prototypes = np.flatnonzero(selected)
+                model.fit(x_train[prototypes], y_train[prototypes])
+
+                wrong = model.predict(np.asarray(x_train[rows], dtype=np.float64) / model.x_scale) != y_train[rows]
+
+                if wrong.any():
+                    selected[rows[wrong]] = True
+                    changed = True
+
+    finally:
+        model.fit(x_train, y_train)
+
+    return np.flatnonzero(selected)
+
+def reduce(model, use_edit=True):
+
+    # editing removes noisy rows first, so condensing does not keep them as prototypes
+    candidates = edit(model) if use_edit else np.arange(model.x_train.shape[0])
+    return condense(model, candidates)
+
+def timed_predict(model, x_test, repeat=3):
+
+    timings = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        labels = model.predict(x_test)
+        timings.append(time.perf_counter() - started)
+
+    return labels, min(timings)
+
+def evaluate(x_path='features/x.npy', y_path='features/y.npy', holdout=0.2,
+             n_samples=20000, seed=0, use_edit=True):
+
+    rng = np.random.default_rng(seed)
+
+    full = ManhattanKNN(x_path=x_path, y_path=y_path)
+    x_all = np.asarray(full.x_train)
+    y_all = np.asarray(full.y_train)
+
+    order = rng.permutation(x_all.shape[0])
+    n_holdout = int(round(x_all.shape[0] * holdout))
+    test, train = order[:n_holdout], order[n_holdout:]
+
+    # reference and reduced models are both built from the rows outside the holdout
+    reference = ManhattanKNN(x_path=x_path, y_path=y_path).fit(x_all[train], y_all[train])
+    prototypes = train[reduce(reference, use_edit)]
+    reduced = ManhattanKNN(x_path=x_path, y_path=y_path).fit(x_all[prototypes], y_all[prototypes])
+
+    # probes are jittered training rows: uniform points mostly land far from any real reading,
+    # where both models are extrapolating and their disagreement says little
+    x_probe = x_all[rng.choice(train, n_samples)] + rng.normal(0, PROBE_JITTER, size=(n_samples, x_all.shape[1]))
+    reference_probe, reference_seconds = timed_predict(reference, x_probe)
+    reduced_probe, reduced_seconds = timed_predict(reduced, x_probe)
+
+    reference_test = reference.predict(x_all[test])
+    reduced_test = reduced.predict(x_all[test])
+
+    return {'rows_train': int(train.shape[0]),
+            'rows_prototypes': int(prototypes.shape[0]),
+            'compression': train.shape[0] / prototypes.shape[0],
+            'holdout_rows': int(test.shape[0]),
+            'holdout_agreement': float(np.mean(reference_test == reduced_test)),
+            'holdout_accuracy_full': float(np.mean(reference_test == y_all[test])),
+            'holdout_accuracy_reduced': float(np.mean(reduced_test == y_all[test])),
+            'probe_rows': int(n_samples),
+            'probe_agreement': float(np.mean(reference_probe == reduced_probe)),
+            'seconds_full': reference_seconds,
+            'seconds_reduced': reduced_seconds,
+            'speedup': reference_seconds / reduced_seconds}
+
+def build(out_path, x_path='features/x.npy', y_path='features/y.npy', use_edit=True):
+
+    # the shipped prototypes are reduced from every training row; evaluate() measures the method
+    model = ManhattanKNN(x_path=x_path, y_path=y_path)
+    prototypes = reduce(model, use_edit)
+
+    save_compact(out_path, np.asarray(model.x_train)[prototypes], np.asarray(model.y_train)[prototypes],
+                 MinMaxScaler(), dtype='float64')
+
+    return {'rows_full': int(model.x_train.shape[0]),
+            'rows_prototypes': int(prototypes.shape[0]),
+            'compression': model.x_train.shape[0] / prototypes.shape[0]}
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Reduce the KNN training set to condensed/edited prototypes.")
+    parser.add_argument('output', nargs='?', default='features/prototypes.npz')
+    parser.add_argument('--x-path', default='features/x.npy')
+    parser.add_argument('--y-path', default='features/y.npy')
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--samples', type=int, default=20000, help="random probe rows used for agreement and timing")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-edit', action='store_true', help="condense only, without the editing pass")
+    args = parser.parse_args(argv)
+
+    report = {'build': build(args.output, args.x_path, args.y_path, not args.no_edit),
+              'evaluation': evaluate(args.x_path, args.y_path, args.holdout,
+                                     args.samples, args.seed, not args.no_edit)}
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
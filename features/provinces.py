@@ -0,0 +1,29 @@
+import csv
+from functools import lru_cache
+from typing import NamedTuple
+
+CSV_PATH = 'lat_long.csv'
+
+class Province(NamedTuple):
+    name: str
+    latitude: float
+    longitude: float
+
+@lru_cache(maxsize=None)
+def load_provinces(path=CSV_PATH):
+
+    # parsed once per process into an immutable tuple; plain csv keeps pandas off the startup path
+    with open(path, newline='', encoding='utf-8') as f:
+        return tuple(Province(row['name'], float(row['latitude']), float(row['longitude']))
+                     for row in csv.DictReader(f))
+
+def province_names(path=CSV_PATH):
+    return tuple(dict.fromkeys(i.name for i in load_provinces(path)))
+
+def get_province(name, path=CSV_PATH):
+
+    for province in load_provinces(path):
+        if province.name == name:
+            return province
+
+    raise KeyError(name)
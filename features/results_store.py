@@ -0,0 +1,162 @@
+import datetime
+import os
+import threading
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from features.export import write_atomic
+from features.history_cache import SETTLE
+from features.ingest import POLLUTANTS
+from features.instrumentation import timed
+
+CACHE_DIR = os.getenv("AIR_QUALITY_CACHE_DIR", ".cache")
+ROOT_NAME = "daily_results"
+
+FORMAT_VERSION = 1
+
+COLUMNS = POLLUTANTS + ['label']
+
+SECONDS_PER_DAY = 86400
+
+_lock = threading.Lock()
+
+def root():
+    return os.path.join(CACHE_DIR, ROOT_NAME)
+
+def partition_path(province, year, base=None):
+
+    # one file per (province, year); names are quoted so any province name is a safe directory
+    return os.path.join(base or root(), f"province={quote(province, safe='')}", f"year={year}.npz")
+
+def settled_until(now=None):
+
+    # the last day whose hours can no longer change upstream, like history_cache's SETTLE rule
+    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp()) if now is None else int(now)
+    return np.datetime64((now - SETTLE) // SECONDS_PER_DAY - 1, 'D')
+
+def year_days(year):
+    return np.arange(np.datetime64(f"{year}-01-01"), np.datetime64(f"{year + 1}-01-01"))
+
+def load_partition(path, model, columns=COLUMNS):
+
+    # np.load reads members lazily, so only the requested columns come off disk
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as store:
+        if int(store['version']) != FORMAT_VERSION or str(store['model']) != model:
+            return None
+
+        partition = {'date': store['date'], 'covered': store['covered']}
+        partition.update((column, store[column]) for column in columns)
+
+        return partition
+
+def save_partition(path, partition, model):
+    write_atomic(path, lambda f: np.savez(f, version=np.array(FORMAT_VERSION), model=np.array(model), **partition))
+
+@timed('results.store')
+def store(province, daily, start, end, model, now=None, base=None):
+
+    # upserts the days in [start, end] (inclusive dates); days without a row are recorded as
+    # computed-but-empty, and days that are not final yet are left out entirely
+    start = np.datetime64(start, 'D')
+    end = min(np.datetime64(end, 'D'), settled_until(now))
+
+    if end < start:
+        return 0
+
+    if daily is None:
+        daily = pd.DataFrame(columns=COLUMNS, index=pd.Index([], name='time'))
+
+    dates = np.asarray(pd.to_datetime(pd.Index(daily.index)).values.astype('datetime64[D]'))
+    values = {column: np.asarray(daily[column], dtype=np.int8 if column == 'label' else np.float64)
+              for column in COLUMNS}
+
+    written = 0
+
+    for year in range(start.astype(object).year, end.astype(object).year + 1):
+        days = year_days(year)
+        first, last = max(start, days[0]), min(end, days[-1])
+
+        rows = (dates >= first) & (dates <= last)
+        path = partition_path(province, year, base)
+
+        with _lock:
+            partition = load_partition(path, model) or {'date': np.array([], dtype='datetime64[D]'),
+                                                        'covered': np.zeros(days.shape[0], dtype=bool),
+                                                        **{column: np.array([], dtype=values[column].dtype)
+                                                           for column in COLUMNS}}
+
+            # rows for the recomputed days replace the old ones, so repeating a backfill changes nothing
+            keep = (partition['date'] < first) | (partition['date'] > last)
+            date = np.concatenate([partition['date'][keep], dates[rows]])
+            order = np.argsort(date, kind='stable')
+
+            merged = {'date': date[order]}
+            for column in COLUMNS:
+                merged[column] = np.concatenate([partition[column][keep], values[column][rows]])[order]
+
+            covered = partition['covered'].copy()
+            covered[(days >= first) & (days <= last)] = True
+            merged['covered'] = covered
+
+            save_partition(path, merged, model)
+
+        written += int(rows.sum())
+
+    return written
+
+def missing_range(province, start, end, model, base=None):
+
+    # the smallest span of days in [start, end] that still has to be computed, or None
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+    missing = []
+
+    for year in range(start.astype(object).year, end.astype(object).year + 1):
+        days = year_days(year)
+        wanted = (days >= start) & (days <= end)
+
+        partition = load_partition(partition_path(province, year, base), model, columns=())
+        covered = partition['covered'] if partition is not None else np.zeros(days.shape[0], dtype=bool)
+
+        missing.append(days[wanted & ~covered])
+
+    missing = np.concatenate(missing)
+
+    if missing.shape[0] == 0:
+        return None
+
+    return missing[0].astype(object), missing[-1].astype(object)
+
+@timed('results.read')
+def read(provinces, start, end, model, columns=COLUMNS, base=None):
+
+    # rows of every province in [start, end], touching only the (province, year) files in range
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+    frames = []
+
+    for province in provinces:
+        for year in range(start.astype(object).year, end.astype(object).year + 1):
+            partition = load_partition(partition_path(province, year, base), model, columns)
+
+            if partition is None:
+                continue
+
+            # dates are sorted within a partition, so the range is two binary searches
+            lo, hi = np.searchsorted(partition['date'], [start, end + 1])
+            if hi <= lo:
+                continue
+
+            frame = pd.DataFrame({column: partition[column][lo:hi] for column in columns},
+                                 index=pd.Index(partition['date'][lo:hi].astype(object), name='time'))
+            frame['provinsi'] = province
+            frames.append(frame)
+
+    if not frames:
+        empty = {column: np.array([], dtype=np.int8 if column == 'label' else np.float64) for column in columns}
+        return pd.DataFrame({**empty, 'provinsi': np.array([], dtype=object)}, index=pd.Index([], name='time'))
+
+    return pd.concat(frames)
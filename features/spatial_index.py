@@ -0,0 +1,155 @@
+import numpy as np
+
+class ManhattanKDTree:
+
+    def __init__(self, x_train, leaf_size=32, block_rows=1024):
+
+        self.x_train = np.ascontiguousarray(x_train, dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.block_rows = block_rows
+
+        # flat node arrays: children (-1 for leaves), the slice of self.index a
+        # node owns, and the bounding box of the points below it
+        self.left = []
+        self.right = []
+        self.start = []
+        self.stop = []
+        self.lower = []
+        self.upper = []
+
+        self.index = np.arange(self.x_train.shape[0])
+        if self.x_train.shape[0]:
+            self.build(0, self.x_train.shape[0])
+
+        n_features = self.x_train.shape[1]
+
+        self.left = np.array(self.left, dtype=np.int64)
+        self.right = np.array(self.right, dtype=np.int64)
+        self.start = np.array(self.start, dtype=np.int64)
+        self.stop = np.array(self.stop, dtype=np.int64)
+        self.lower = np.array(self.lower, dtype=np.float64).reshape(-1, n_features)
+        self.upper = np.array(self.upper, dtype=np.float64).reshape(-1, n_features)
+
+        self.pack_leaves()
+
+    def build(self, start, stop):
+
+        node = len(self.left)
+        points = self.x_train[self.index[start:stop]]
+
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(start)
+        self.stop.append(stop)
+        self.lower.append(points.min(axis=0))
+        self.upper.append(points.max(axis=0))
+
+        if stop - start <= self.leaf_size:
+            return node
+
+        # split on the widest dimension at the median
+        dim = int(np.argmax(self.upper[node] - self.lower[node]))
+        middle = (stop - start) // 2
+        order = np.argpartition(points[:, dim], middle)
+        self.index[start:stop] = self.index[start:stop][order]
+
+        self.left[node] = self.build(start, start + middle)
+        self.right[node] = self.build(start + middle, stop)
+
+        return node
+
+    def pack_leaves(self):
+
+        # every leaf padded to leaf_size rows, one array per feature, so a batch of queries can
+        # scan any set of leaves in one gather; padding sits at +inf with an index past the end
+        leaves = np.flatnonzero(self.left == -1)
+        n_rows, n_features = self.x_train.shape
+        width = max(1, int((self.stop[leaves] - self.start[leaves]).max())) if leaves.shape[0] else 1
+
+        self.leaf_lower = self.lower[leaves]
+        self.leaf_upper = self.upper[leaves]
+        self.leaf_count = self.stop[leaves] - self.start[leaves]
+        self.leaf_index = np.full((leaves.shape[0], width), n_rows, dtype=np.int64)
+        self.leaf_columns = np.full((n_features, leaves.shape[0], width), np.inf)
+
+        for i, node in enumerate(leaves):
+            rows = self.index[self.start[node]:self.stop[node]]
+            self.leaf_index[i, :rows.shape[0]] = rows
+            self.leaf_columns[:, i, :rows.shape[0]] = self.x_train[rows].T
+
+    def box_distance(self, x):
+
+        # L1 distance from every query to the closest point of every leaf's bounding box
+        bound = np.zeros((x.shape[0], self.leaf_lower.shape[0]))
+
+        for j in range(x.shape[1]):
+            bound += np.maximum(self.leaf_lower[:, j] - x[:, j, None], 0)
+            bound += np.maximum(x[:, j, None] - self.leaf_upper[:, j], 0)
+
+        return bound
+
+    def scan(self, x, leaves):
+
+        # distances from each query row to every point of its leaf (one leaf per row), accumulated
+        # column by column in the same order as ManhattanKNN.distance_block
+        distance = np.zeros((x.shape[0], self.leaf_index.shape[1]))
+
+        for j in range(x.shape[1]):
+            distance += np.abs(self.leaf_columns[j][leaves] - x[:, j, None])
+
+        return distance, self.leaf_index[leaves]
+
+    def query_block(self, x, k):
+
+        bound = self.box_distance(x)
+
+        # the nearest leaves holding at least k points bound the k-th distance from above; usually
+        # every leaf has k points and the single nearest one is enough
+        if self.leaf_count.min() >= k:
+            order = np.argmin(bound, axis=1)[:, None]
+        else:
+            order = np.argsort(bound, axis=1, kind='stable')
+            order = order[:, :int((np.cumsum(self.leaf_count[order], axis=1) >= k).argmax(axis=1).max()) + 1]
+
+        seeds = order.shape[1]
+        distance, _ = self.scan(np.repeat(x, seeds, axis=0), order.reshape(-1))
+        radius = np.partition(distance.reshape(x.shape[0], -1), k - 1, axis=1)[:, k - 1]
+
+        # rows with missing values compare false everywhere, so they fall back to every leaf
+        bound = np.where(np.isnan(bound), 0.0, bound)
+        radius = np.where(np.isnan(radius), np.inf, radius)
+
+        # every (query, leaf) pair whose box lies within the radius may hold a neighbor; equal bounds
+        # are kept so exact-distance ties match brute force. Pairs come out grouped by query.
+        query, leaf = np.nonzero(bound <= radius[:, None])
+        distance, index = self.scan(x[query], leaf)
+
+        # the best k of each leaf, then the best k over each query's leaves, ordered by
+        # (distance, train index) so ties prefer the lower index
+        keep = min(k, distance.shape[1])
+        pairs = np.arange(query.shape[0])[:, None]
+        best = np.lexsort((index, distance), axis=1)[:, :keep]
+
+        distance = distance[pairs, best].reshape(-1)
+        index = index[pairs, best].reshape(-1)
+        owner = np.repeat(query, keep)
+
+        ranked = np.lexsort((index, distance, owner))
+        first = np.searchsorted(owner[ranked], np.arange(x.shape[0]))
+
+        return index[ranked[first[:, None] + np.arange(k)]]
+
+    def query(self, x_test, k):
+
+        x_test = np.asarray(x_test, dtype=np.float64).reshape(-1, self.x_train.shape[1])
+        k = min(k, self.x_train.shape[0])
+
+        result = np.empty((x_test.shape[0], k), dtype=np.int64)
+        if k == 0:
+            return result
+
+        for start in range(0, x_test.shape[0], self.block_rows):
+            stop = start + self.block_rows
+            result[start:stop] = self.query_block(x_test[start:stop], k)
+
+        return result
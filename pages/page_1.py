@@ -1,10 +1,28 @@
 import streamlit as st
-from features.machine_learning import MinMaxScaler, ManhattanKNN
-import numpy as np
-import requests
-import pandas as pd
+from features.debug_panel import debug_session
+from features.instrumentation import stage
+from features.provinces import load_provinces, province_names
 
+import datetime
 import os
+import time
+
+def is_stale(collected_at):
+
+    from features.collector import STALE_AFTER
+
+    return int(time.time()) - collected_at > STALE_AFTER
+
+def show_staleness(collected_at):
+
+    age = max(0, int(time.time()) - collected_at)
+    when = datetime.datetime.fromtimestamp(collected_at).strftime("%d-%m-%Y %H:%M")
+
+    st.caption(f"Data diambil pada {when} ({age // 60} menit yang lalu).")
+
+    # still stale after the page's own refresh, so the collector or the API is down
+    if is_stale(collected_at):
+        st.warning(f"Data belum diperbarui selama {age // 60} menit.")
 
 def main():
 
@@ -13,9 +31,11 @@ def main():
     subfeature = st.radio(
                         "Pilih Subfitur",
                         ["Kualitas Udara Sekarang di Provinsi Tertentu",
+                         "Kualitas Udara Sekarang di Semua Provinsi",
                          "Input Pribadi"],
                         captions=[
                             "Memprediksi kualitas udara berdasarkan nama provinsi",
+                            "Memprediksi kualitas udara seluruh provinsi sekaligus",
                             "Input data yang diperlukan secara pribadi"
                         ],
                     )
@@ -25,81 +45,103 @@ def main():
     
     if subfeature == 'Kualitas Udara Sekarang di Provinsi Tertentu':
 
-        csv_path = 'lat_long.csv'
-        data = pd.read_csv(csv_path)
-
-        def get_air_pollution_data(latitude, 
-                               longitude):
-        
-            base_url = "http://api.openweathermap.org/data/2.5/air_pollution"
-            params = {
-                'lat': latitude,
-                'lon': longitude,
-                'appid': st.secrets.get("API_KEY") or os.getenv("API_KEY")
-            }
-
-            try:
-
-                response = requests.get(base_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                return data['list'][0]['components']
-            
-            except requests.exceptions.RequestException as e:
-
-                print(f"Error fetching air pollution data: {e}")
-                return None
-        
         option = st.selectbox(
                         "Pilih berdasarkan nama provinsi.",
-                        tuple(data['name'].tolist()),
+                        province_names(),
                     )
 
         if st.button("Prediksi"):
 
-            lat = data[data['name'] == option]['latitude']
-            long = data[data['name'] == option]['longitude']
+            # the collector keeps a local store of every province's latest reading; the API is
+            # only called from here when the store has nothing yet or the reading has gone stale
+            from features.collector import latest, collect_once, start_collector, INTERVAL
+            from features.labels import CATEGORY
 
-            data = get_air_pollution_data(lat, long)
+            api_key = st.secrets.get("API_KEY") or os.getenv("API_KEY")
 
-            category = {0:'BAIK',
-                        1:'SEDANG',
-                        2:'TIDAK SEHAT',
-                        3:'SANGAT TIDAK SEHAT'}
-            
-            model = ManhattanKNN()
-            scaler = MinMaxScaler()
-
-            data = np.array([[abs(data['pm10']),
-                                abs(data['pm2_5']),
-                                abs(data['so2']),
-                                abs(data['co']),
-                                abs(data['o3']),
-                                abs(data['no2'])]])
-            
-            data_normalized = scaler.transform(data)
-            
-            prediction = category[model.predict(data_normalized)[0]]
+            with stage('page1.read_store'):
+                reading = latest(option)
+
+            # collect_once skips the cycle when another process collected within the interval
+            if reading is None or is_stale(reading['collected_at']):
+                with stage('page1.collect'):
+                    collect_once(api_key, interval=INTERVAL)
+                reading = latest(option)
+
+            # started after the inline cycle, whose timestamp makes the thread skip its own first one
+            start_collector(api_key)
+
+            if reading is None:
+                st.error("Gagal mengambil data kualitas udara.")
+                return
+
+            prediction = CATEGORY[reading['label']]
 
             st.write("---")
 
             st.write(f"**Nama Kota:** {option}")
 
-            st.write(f"**Nilai PM10 (µg/m³):** {data[0][0]} ")
-            st.write(f"**Nilai PM2.5 (µg/m³):** {data[0][1]}")
-            st.write(f"**Nilai SO2 (µg/m³):** {data[0][2]}")
+            st.write(f"**Nilai PM10 (µg/m³):** {reading['pm10']} ")
+            st.write(f"**Nilai PM2.5 (µg/m³):** {reading['pm2_5']}")
+            st.write(f"**Nilai SO2 (µg/m³):** {reading['so2']}")
 
-            st.write(f"**Nilai CO (µg/m³):** {data[0][3]}")
-            st.write(f"**Nilai O3 (µg/m³):** {data[0][4]}")
-            st.write(f"**Nilai NO2 (µg/m³):** {data[0][5]}")
+            st.write(f"**Nilai CO (µg/m³):** {reading['co']}")
+            st.write(f"**Nilai O3 (µg/m³):** {reading['o3']}")
+            st.write(f"**Nilai NO2 (µg/m³):** {reading['no2']}")
 
             st.write(f"**Hasil Prediksi:** {prediction}")
 
+            show_staleness(reading['collected_at'])
+
             st.write("---")
             
             st.write("Berhasil melakukan prediksi!") 
 
+    elif subfeature == 'Kualitas Udara Sekarang di Semua Provinsi':
+
+        provinces = load_provinces()
+
+        if st.button("Prediksi"):
+
+            import pandas as pd
+            from features.collector import latest_all, collect_once, start_collector, INTERVAL
+            from features.labels import to_categorical
+
+            api_key = st.secrets.get("API_KEY") or os.getenv("API_KEY")
+
+            with stage('page1.read_store'):
+                rows = latest_all()
+
+            if not rows or is_stale(min(i['collected_at'] for i in rows)):
+                with stage('page1.collect', rows=len(provinces)):
+                    collect_once(api_key, interval=INTERVAL)
+                rows = latest_all()
+
+            start_collector(api_key)
+
+            if not rows:
+                st.error("Gagal mengambil data kualitas udara.")
+                return
+
+            table = pd.DataFrame(rows)
+            table = table[['province', 'pm10', 'pm2_5', 'so2', 'co', 'o3', 'no2', 'label']]\
+                        .rename(columns={'province': 'provinsi', 'pm2_5': 'pm2.5'})
+            table['label'] = to_categorical(table['label'])
+
+            st.write("---")
+
+            st.dataframe(table, hide_index=True)
+
+            if len(rows) < len(provinces):
+                st.warning(f"{len(provinces) - len(rows)} provinsi gagal diambil datanya.")
+
+            # the oldest row decides how fresh the table is as a whole
+            show_staleness(min(i['collected_at'] for i in rows))
+
+            st.write("---")
+
+            st.write("Berhasil melakukan prediksi!")
+
     elif subfeature == 'Input Pribadi':
 
         city_name = st.text_input("Nama Kota:")
@@ -119,14 +161,13 @@ def main():
                                     step=0.1)
 
         if st.button("Prediksi"):
+
+            import numpy as np
+            from features.labels import names
+            from features.model_registry import get_predictor, get_scaler
             
-            category = {0:'BAIK',
-                        1:'SEDANG',
-                        2:'TIDAK SEHAT',
-                        3:'SANGAT TIDAK SEHAT'}
-            
-            model = ManhattanKNN()
-            scaler = MinMaxScaler()
+            model = get_predictor()
+            scaler = get_scaler()
 
             data = scaler.transform(np.array([[pollutant1,
                                             pollutant2,
@@ -135,7 +176,7 @@ def main():
                                             pollutant5,
                                             pollutant6]]))
             
-            prediction = category[model.predict(data)[0]]
+            prediction = names(model.predict(data))[0]
 
             st.write("---")
 
@@ -156,4 +197,5 @@ def main():
             st.write("Data telah di-submit dan sukses diprediksi") 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with debug_session():
+        main()
\ No newline at end of file
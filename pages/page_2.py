@@ -1,7 +1,5 @@
 import streamlit as st
-import pandas as pd
-from features.machine_learning import MinMaxScaler, ManhattanKNN
-from io import BytesIO
+from features.debug_panel import debug_session
 
 def main():
     
@@ -26,137 +24,120 @@ def main():
                  label="Kembali ke awal")
 
     if uploaded_file is not None:
+
+        # pandas, the model and the export machinery are only needed once there is a file
+        from features import arrow_engine
+        from features.model_registry import get_predictor, get_scaler, model_version
+        from features.ingest import SchemaError, write_labeled_csv, read_labeled_chunks, list_cities
+        from features.dashboard import ALL_CITIES, by_city, get_stats
+        from features.export import content_hash, get_export, is_ready, read_export, parquet_available, \
+                                    write_excel_streaming, write_parquet_streaming, MIME
         
         try:
 
+            scaler = get_scaler()
+            model = get_predictor()
+
+            # exports depend on the engine that wrote them; the scored artifact the dashboard reads
+            # back has a key of its own, so no download of the same format can stand in for it
+            upload_key = content_hash(uploaded_file, model_version(), arrow_engine.active_engine())
+            scored_key = content_hash(upload_key, 'scored')
+
+            # the Arrow engine scores into a dictionary-encoded Parquet file, the default one into CSV;
+            # whichever it is, the other formats and the dashboard are read back from it
+            if arrow_engine.enabled():
+                scored = 'parquet'
+                write_labeled = arrow_engine.write_labeled_parquet
+                read_cities = arrow_engine.list_cities
+                read_stats = arrow_engine.by_city
+
+                builders = {'csv': lambda f: arrow_engine.write_csv(arrow_engine.read_labeled_tables(scored_path), f),
+                            'xlsx': lambda f: write_excel_streaming(arrow_engine.read_labeled_frames(scored_path), f)}
+            else:
+                scored = 'csv'
+                write_labeled = write_labeled_csv
+                read_cities = list_cities
+                read_stats = lambda path: by_city(read_labeled_chunks(path))
+
+                builders = {'xlsx': lambda f: write_excel_streaming(read_labeled_chunks(scored_path), f),
+                            'parquet': lambda f: write_parquet_streaming(read_labeled_chunks(scored_path), f)}
+
+            def build_scored(f):
+                uploaded_file.seek(0)
+                write_labeled(uploaded_file, scaler, model, output=f)
+
             try:
-                df = pd.read_csv(uploaded_file)
+                scored_path = get_export(scored_key, scored, build_scored)
 
-            except:
-                df = pd.read_excel(uploaded_file)
-            
-            columns = {'nama_kota', 'tanggal', 'pm10', 'pm2.5',
-                       'so2', 'co', 'o3', 'no2'}
-            
-            if columns & set(df.columns) != columns:
-                st.error("Kolom masih belum sesuai! ")
-                return 
-            
-            columns2 = ['pm10', 'pm2.5',
-                        'so2', 'co', 'o3', 'no2']
-            
-            data = df[columns2].to_numpy()
-            scaler = MinMaxScaler()
-            model = ManhattanKNN()
-
-            data = scaler.transform(data)
-            df['label'] = model.predict(data)
-            df['label'] = df['label'].replace({0:'BAIK',
-                                               1:'SEDANG',
-                                               2:'TIDAK SEHAT',
-                                               3:'SANGAT TIDAK SEHAT'})
-            
-            csv_buffer = BytesIO()
-            df.to_csv(csv_buffer, 
-                      index=False)
-            csv_buffer.seek(0)
-
-            st.download_button(
-                label="Download sebagai CSV",
-                data=csv_buffer,
-                file_name=uploaded_file.name,
-                mime="text/csv",
-            )
-
-            excel_buffer = BytesIO()
-            df.to_excel(excel_buffer, 
-                        index=False, 
-                        sheet_name="Sheet1")
-            excel_buffer.seek(0)
-
-            excel_file_name = f"{uploaded_file.name.rsplit('.', 1)[0]}.xlsx" \
+            except SchemaError as e:
+                st.error(str(e))
+                return
+
+            cities = read_cities(scored_path)
+
+            base_name = uploaded_file.name.rsplit('.', 1)[0]
+
+            excel_file_name = f"{base_name}.xlsx" \
                                 if '.csv' in uploaded_file.name \
                                 else uploaded_file.name
 
-            st.download_button(
-                label="Download sebagai Excel",
-                data=excel_buffer,
-                file_name=excel_file_name,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            )
+            downloads = [('csv', "CSV", uploaded_file.name),
+                         ('xlsx', "Excel", excel_file_name)]
 
+            if parquet_available():
+                downloads.append(('parquet', "Parquet", f"{base_name}.parquet"))
+
+            # only the scored file is built up front; other formats wait until they are asked for
+            for fmt, label, file_name in downloads:
+
+                if fmt == scored or is_ready(upload_key, fmt) or st.button(f"Siapkan file {label}"):
+
+                    path = scored_path if fmt == scored \
+                                else get_export(upload_key, fmt, builders[fmt])
+
+                    st.download_button(
+                        label=f"Download sebagai {label}",
+                        data=read_export(path),
+                        file_name=file_name,
+                        mime=MIME[fmt],
+                    )
+
+            # the dashboard stays open across the reruns caused by picking another city
             if st.button("Tampilkan Dashboard"):
+                st.session_state['page_2_dashboard'] = upload_key
+
+            if st.session_state.get('page_2_dashboard') == upload_key:
 
                 city_name = st.selectbox(
                             "Pilih kota berdasarkan data yang diinput.",
-                            tuple(df['nama_kota'].unique()\
-                                                .tolist()),
+                            tuple(cities),
                         )
-                
-                eda_data = df[df['nama_kota'] == city_name]
+
+                stats = get_stats(upload_key,
+                                  city_name,
+                                  lambda: read_stats(scored_path))
 
                 st.subheader(f"Grafik Sebaran Kategori Kualitas Udara Di {city_name}:")
                 st.bar_chart(
-                    data=eda_data.groupby('label')\
-                        .agg({'so2':'count'})
-                        .reset_index()\
-                        .rename(columns={'so2':'count'}),
+                    data=stats.label_counts(),
                     x='label',
                     y='count'
                 )
                     
                 st.subheader(f"Grafik Sebaran Rata-rata Data Kandungan Udara Dari Data Berdasarkan Kategori Di {city_name}:")
-                grouped_data = eda_data.groupby(by=['label'])\
-                                .agg(dict(
-                                        zip(
-                                            ['pm10', 'pm2.5', 'so2', 
-                                            'co', 'o3', 'no2'],
-                                            ['mean'] * 6
-                                            )
-                                        )
-                                )\
-                                .reset_index()
-
-                air_parameters = []
-                values = []
-                labels = []
-
-                for i in ['pm10', 'pm2.5', 'so2', 
-                            'co', 'o3', 'no2']:
-                    
-                    temp_data = grouped_data[[i, 'label']]
-                    air_parameters += [i] * temp_data.shape[0]
-                    values += temp_data[i].tolist()
-                    labels += temp_data['label'].tolist()
-
-                grouped_data = pd.DataFrame({'params':air_parameters,
-                                                'values':values,
-                                                'labels':labels})
-                
-                grouped_data['labels'] = grouped_data['labels'].replace({'BAIK':'0:BAIK',
-                                                                            'SEDANG':'1:SEDANG',
-                                                                            'TIDAK SEHAT':'2:TIDAK SEHAT',
-                                                                            'SANGAT TIDAK SEHAT':'3:SANGAT TIDAK SEHAT'})
-
-                st.bar_chart(data=grouped_data, 
+                st.bar_chart(data=stats.mean_table(), 
                                 x="params", 
                                 y="values", 
                                 color="labels", 
                                 stack=False,
                                 horizontal=False)
 
+                # correlations have always been taken over the whole upload, not the selected city
+                overall = get_stats(upload_key, ALL_CITIES, lambda: read_stats(scored_path))
+
                 st.subheader(f"Grafik Korelasi Keenam Polutan Udara Terhadap Kualitas Udara Di {city_name}")
-                corr_df = df[['pm10','pm2.5','so2','co',
-                              'o3','no2','label']]\
-                            .replace({'BAIK':0,
-                                      'SEDANG':1,
-                                      'TIDAK SEHAT':2,
-                                      'SANGAT TIDAK SEHAT':3})\
-                            .corr(method='pearson')[['label']].head(-1)\
-                            .reset_index()
-                
                 st.bar_chart(
-                        corr_df,
+                        overall.correlations(),
                         x='index',
                         y='label'
                     )
@@ -165,4 +146,5 @@ def main():
             st.error(f"An error occurred while reading the file: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with debug_session():
+        main()
\ No newline at end of file
@@ -1,161 +1,156 @@
 import streamlit as st
-import pandas as pd
-import requests
+from features.debug_panel import debug_session
+from features.instrumentation import stage
+from features.provinces import load_provinces, province_names, get_province
 import datetime
-from features.machine_learning import ManhattanKNN, MinMaxScaler
-from io import BytesIO
 
 import os
 
-def main():
+YEARS = tuple(range(2021, 2025, 1))
 
-    def get_hourly_air_pollution(latitude, 
-                                 longitude, 
-                                 start_ts, 
-                                 end_ts):
+def date_to_unix(date):
+    return int(datetime.datetime.combine(date, datetime.time(), tzinfo=datetime.timezone.utc).timestamp())
 
-        api_key = st.secrets.get("API_KEY") or os.getenv("API_KEY")
-        url = f"http://api.openweathermap.org/data/2.5/air_pollution/history?lat={latitude}&lon={longitude}&start={start_ts}&end={end_ts}&appid={api_key}"
-        response = requests.get(url)
-        response.raise_for_status()
+def shift_year(date, year):
 
-        data = response.json().get('list', [])
-        return data
+    # the same calendar day in another year; 29 February becomes the 28th
+    try:
+        return date.replace(year=year)
+    except ValueError:
+        return date.replace(year=year, day=28)
 
-    def process_hourly_to_daily(hourly_data):
+def load_daily(province_rows, start_date, end_date, api_key):
 
-        if not hourly_data:
-            return None
-        
-        data = [i['components'] for i in hourly_data]
-        time_data = [i['dt'] for i in hourly_data]
-
-        df = {'time':time_data,
-            'pm10':[i['pm10'] for i in data],
-            'pm2.5':[i['pm2_5'] for i in data],
-            'so2':[i['so2'] for i in data],
-            'co':[i['co'] for i in data],
-            'o3':[i['o3'] for i in data],
-            'no2':[i['no2'] for i in data]}
-        
-        df = pd.DataFrame(df)
-
-        if not df.empty:
-
-            df['time'] = pd.to_datetime(df['time'], 
-                                        unit='s', 
-                                        utc=True)\
-                        .dt.date
-            df = df.groupby('time')\
-                .agg({'pm10':'mean',
-                        'pm2.5':'mean',
-                        'so2':'mean',
-                        'co':'mean',
-                        'o3':'mean',
-                        'no2':'mean'})
-            
-            return df
-        
-        return None
+    # days already in the results store are read back as they are; only the days it is
+    # missing are fetched, aggregated, predicted and written to it
+    import numpy as np
+    import pandas as pd
+    from features.history_cache import get_hourly_history
+    from features.openweathermap import fetch_many
+    from features.daily import process_hourly_to_daily
+    from features.model_registry import get_predictor, get_scaler, model_version
+    from features.ingest import POLLUTANTS
+    from features.results_store import missing_range, read, settled_until, store
 
-    def datetime_to_unix(dt):
-        return int(dt.timestamp())
-    
-    csv_path = 'lat_long.csv'
-    provinces = pd.read_csv(csv_path)
+    model_key = repr(model_version())
+
+    gaps = [(row, missing_range(row.name, start_date, end_date, model_key)) for row in province_rows]
+    gaps = [(row, gap) for row, gap in gaps if gap is not None]
+    recent = {}
+
+    if gaps:
+        # histories are fetched concurrently; a single province is just a batch of one
+        with stage('page3.fetch_history', rows=len(gaps)):
+            histories = fetch_many(get_hourly_history,
+                                   [(row.latitude, row.longitude,
+                                     date_to_unix(first), date_to_unix(last) + 86399, api_key)
+                                    for row, (first, last) in gaps])
+
+        # a failed fetch is not recorded, so the same days are tried again next time
+        fetched = [(row, gap, process_hourly_to_daily(history))
+                   for (row, gap), history in zip(gaps, histories) if history is not None]
+        dailies = [daily for _, _, daily in fetched if daily is not None]
+
+        # one batched prediction for the new days of every province, split back afterwards
+        if dailies:
+            for daily in dailies:
+                daily[POLLUTANTS] = daily[POLLUTANTS].abs()
+
+            values = np.concatenate([daily[POLLUTANTS].to_numpy() for daily in dailies])
+            labels = get_predictor().predict(get_scaler().transform(values))
+
+            for daily, part in zip(dailies, np.split(labels, np.cumsum([len(i) for i in dailies])[:-1])):
+                daily['label'] = part
+
+        settled = settled_until().astype(object)
+
+        for row, (first, last), daily in fetched:
+
+            # days that can still change are shown but not stored
+            if daily is not None:
+                recent[row.name] = daily[[i > settled for i in daily.index]].assign(provinsi=row.name)
+
+            store(row.name, daily, first, last, model_key)
+
+    frames = []
+    for row in province_rows:
+        frames.append(read([row.name], start_date, end_date, model_key))
+
+        if row.name in recent:
+            frames.append(recent[row.name])
+
+    return pd.concat(frames)
+
+def main():
+
+    all_provinces = "Semua Provinsi"
 
     province = st.selectbox(
                         "Pilih berdasarkan nama provinsi.",
-                        tuple(provinces['name'].unique()\
-                                               .tolist()),
+                        province_names() + (all_provinces,),
                     )
     
     year_time = st.selectbox(
                         "Pilih periode berdasarkan tahun:",
-                        tuple(range(2021, 2025, 1)),
+                        YEARS,
                     )
+
+    first_day = datetime.date(year_time, 1, 1)
+    last_day = datetime.date(year_time, 12, 31)
+
+    date_range = st.date_input(
+                        "Pilih rentang tanggal:",
+                        value=(first_day, last_day),
+                        min_value=first_day,
+                        max_value=last_day,
+                    )
+
+    # while the second date is being picked the widget holds a single date
+    start_date, end_date = (tuple(date_range) * 2)[:2] if isinstance(date_range, (tuple, list)) \
+                               else (date_range, date_range)
     
     st.page_link("app.py", 
                  label="Kembali ke awal")
 
-    start = datetime.datetime(year_time, 1, 1, 0, 0, 0, 
-                              tzinfo=datetime.timezone.utc)
-    end = datetime.datetime(year_time, 12, 31, 23, 59, 59, 
-                            tzinfo=datetime.timezone.utc)
+    # nothing is fetched until asked for; the request outlives the reruns caused by other widgets
+    if st.button("Tampilkan"):
+        st.session_state['page_3_request'] = (province, year_time)
 
-    start_ts = datetime_to_unix(start)
-    end_ts = datetime_to_unix(end)
+    if st.session_state.get('page_3_request') != (province, year_time):
+        return
 
-    province_row = provinces[provinces['name'] == province]
-    lat, long = province_row['latitude'].to_list()[0], province_row['longitude'].to_list()[0]
+    from features import arrow_engine
+    from features.dashboard import from_frame
+    from features.labels import to_categorical
+    from features.model_registry import model_version
+    from features.export import frame_hash, get_export, is_ready, read_export, parquet_available, \
+                                write_csv, write_excel, write_parquet, write_parquet_tables, MIME
 
-    data = get_hourly_air_pollution(lat,
-                                    long,
-                                    start_ts,
-                                    end_ts)
-    
-    data = process_hourly_to_daily(data)
-    columns2 = ['pm10', 'pm2.5',
-                'so2', 'co', 'o3', 'no2']
-    
-    for i in columns2:
-        data[i] = data[i].apply(lambda x: abs(x))
-            
-    data_to_predict = data[columns2].to_numpy()
-    scaler = MinMaxScaler()
-    model = ManhattanKNN()
-
-    data_to_predict = scaler.transform(data_to_predict)
-    data['label'] = model.predict(data_to_predict)
-    data['label'] = data['label'].replace({0:'BAIK',
-                                            1:'SEDANG',
-                                            2:'TIDAK SEHAT',
-                                            3:'SANGAT TIDAK SEHAT'})
+    def rows_for(name):
+        return load_provinces() if name == all_provinces else (get_province(name),)
+
+    api_key = st.secrets.get("API_KEY") or os.getenv("API_KEY")
+
+    data = load_daily(rows_for(province), start_date, end_date, api_key)
+
+    if data.empty:
+        st.error("Gagal mengambil data kualitas udara.")
+        return
+
+    data['label'] = to_categorical(data['label'])
+
+    # counts, means and correlations all come from one pass over the label codes
+    stats = from_frame(data)
 
     st.subheader(f"Grafik Sebaran Kualitas Udara Dari Tahun {year_time} Di {province}:")
     st.bar_chart(
-    data=data.groupby('label')\
-            .agg({'so2':'count'})
-            .reset_index()\
-            .rename(columns={'so2':'count'}),
+        data=stats.label_counts(),
         x='label',
         y='count'
     )
         
     st.subheader(f"Grafik Sebaran Rata-rata Data Kandungan Udara Dari Data Berdasarkan Kategori Pada Tahun {year_time} Di {province}:")
-    grouped_data = data.groupby(by=['label'])\
-                    .agg(dict(
-                            zip(
-                                ['pm10', 'pm2.5', 'so2', 
-                                'co', 'o3', 'no2'],
-                                ['mean'] * 6
-                                )
-                            )
-                    )\
-                    .reset_index()
-
-    air_parameters = []
-    values = []
-    labels = []
-
-    for i in ['pm10', 'pm2.5', 'so2', 
-                'co', 'o3', 'no2']:
-        
-        temp_data = grouped_data[[i, 'label']]
-        air_parameters += [i] * temp_data.shape[0]
-        values += temp_data[i].tolist()
-        labels += temp_data['label'].tolist()
-
-    grouped_data = pd.DataFrame({'params':air_parameters,
-                                    'values':values,
-                                    'labels':labels})
-    
-    grouped_data['labels'] = grouped_data['labels'].replace({'BAIK':'0:BAIK',
-                                                                'SEDANG':'1:SEDANG',
-                                                                'TIDAK SEHAT':'2:TIDAK SEHAT',
-                                                                'SANGAT TIDAK SEHAT':'3:SANGAT TIDAK SEHAT'})
-
-    st.bar_chart(data=grouped_data, 
+    st.bar_chart(data=stats.mean_table(), 
                     x="params", 
                     y="values", 
                     color="labels", 
@@ -163,52 +158,89 @@ def main():
                     horizontal=False)
 
     st.subheader(f"Grafik  Korelasi Keenam Polutan Udara Terhadap Kualitas Udara Di {province} Tahun {year_time}")
-    corr_df = data[['pm10','pm2.5','so2','co',
-                  'o3','no2','label']]\
-                .replace({'BAIK':0,
-                          'SEDANG':1,
-                          'TIDAK SEHAT':2,
-                          'SANGAT TIDAK SEHAT':3})\
-                .corr(method='pearson')[['label']].head(-1)\
-                .reset_index()
-    
     st.bar_chart(
-            corr_df,
+            stats.correlations(),
             x='index',
             y='label'
         )
     
-    df = data.copy()\
-             .reset_index()\
+    df = data.reset_index()\
              .rename(columns={'time':'tanggal'})
-    df['provinsi'] = [province] * df.shape[0]
     df = df[['provinsi', 'tanggal', 'pm10', 'pm2.5',
              'so2', 'co', 'o3', 'no2', 'label']]
 
-    csv_buffer = BytesIO()
-    df.to_csv(csv_buffer, 
-                index=False)
-    csv_buffer.seek(0)
+    export_key = frame_hash(df, model_version(), arrow_engine.active_engine())
 
-    st.download_button(
-        label="Download sebagai CSV",
-        data=csv_buffer,
-        file_name=f"{province}.csv",
-        mime="text/csv",
-    )
+    builders = {'csv': lambda f: write_csv(df, f),
+                'xlsx': lambda f: write_excel(df, f),
+                'parquet': lambda f: write_parquet(df, f)}
 
-    excel_buffer = BytesIO()
-    df.to_excel(excel_buffer, 
-                index=False, 
-                sheet_name="Sheet1")
-    excel_buffer.seek(0)
-
-    st.download_button(
-        label="Download sebagai Excel",
-        data=excel_buffer,
-        file_name=f"{province}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    if arrow_engine.enabled():
+        builders.update(csv=lambda f: arrow_engine.write_csv([arrow_engine.from_frame(df)], f),
+                        parquet=lambda f: write_parquet_tables([arrow_engine.from_frame(df)], f))
+
+    downloads = [('csv', "CSV", f"{province}.csv"),
+                 ('xlsx', "Excel", f"{province}.xlsx")]
+
+    if parquet_available():
+        downloads.append(('parquet', "Parquet", f"{province}.parquet"))
+
+    # exports are built the first time they are asked for and reused on later reruns
+    for fmt, label, file_name in downloads:
+
+        if is_ready(export_key, fmt) or st.button(f"Siapkan file {label}"):
+
+            st.download_button(
+                label=f"Download sebagai {label}",
+                data=read_export(get_export(export_key, fmt, builders[fmt])),
+                file_name=file_name,
+                mime=MIME[fmt],
+            )
+
+    st.subheader("Perbandingan Sebaran Kualitas Udara")
+
+    compare_provinces = st.multiselect(
+                        "Bandingkan dengan provinsi lain:",
+                        [i for i in province_names() + (all_provinces,) if i != province],
+                    )
+
+    compare_years = st.multiselect(
+                        "Bandingkan dengan tahun lain:",
+                        [i for i in YEARS if i != year_time],
+                    )
+
+    if compare_provinces or compare_years:
+
+        import pandas as pd
+
+        # every (province, year) pair over the same calendar range, read from the results store
+        shares = []
+        for name in [province] + compare_provinces:
+            for year in [year_time] + compare_years:
+
+                if (name, year) == (province, year_time):
+                    group = data
+                else:
+                    group = load_daily(rows_for(name), shift_year(start_date, year),
+                                       shift_year(end_date, year), api_key)
+
+                if group.empty:
+                    continue
+
+                counts = from_frame(group).label_counts()
+                counts['persen'] = counts['count'] / counts['count'].sum() * 100
+                counts['grup'] = f"{name} {year}"
+                shares.append(counts)
+
+        if shares:
+            st.bar_chart(
+                pd.concat(shares),
+                x='label',
+                y='persen',
+                color='grup',
+                stack=False
+            )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with debug_session():
+        main()
\ No newline at end of file